@@ -0,0 +1,151 @@
+# Frame-time benchmark for the Cube Libre demos
+#
+# Runs cube_libre.py and every demo in tests/ headless (see cube_common.py)
+# for a fixed number of frames, each in its own process, and reports frame
+# time percentiles, OpenGL calls per frame and the net growth of Python's
+# allocated memory blocks per frame.
+# The results are written to JSON so that runs of different versions can be
+# compared with --compare.
+#
+# Usage:
+#   python3 benchmark.py                              # all demos, 300 frames each
+#   python3 benchmark.py --frames 1000 cube_libre.py  # just the main demo
+#   python3 benchmark.py --output new.json --compare old.json
+#
+# https://github.com/FlyingFathead/pygame-opengl-polygon-demos
+
+import argparse
+import datetime
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+repo_dir = os.path.dirname(os.path.abspath(__file__))
+results_version = 2
+
+# Every demo script: the main game first, then everything in tests/
+def find_demos():
+    demos = [os.path.join(repo_dir, 'cube_libre.py')]
+    demos += sorted(path for path in glob.glob(os.path.join(repo_dir, 'tests', '*'))
+                    if os.path.isfile(path) and not os.path.basename(path).startswith('__'))
+    return demos
+
+# Summary statistics of one per-frame series
+def summarize(values):
+    if not values:
+        return None
+    values = np.asarray(values, dtype=np.float64)
+    return {
+        'mean': float(values.mean()),
+        'p50': float(np.percentile(values, 50)),
+        'p95': float(np.percentile(values, 95)),
+        'p99': float(np.percentile(values, 99)),
+        'max': float(values.max()),
+    }
+
+# Run one demo headless and collect its per-frame statistics
+def run_demo(path, frames, warmup, timeout, trace_alloc):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        bench_json = os.path.join(temp_dir, 'frames.json')
+        command = [sys.executable, path, '--headless',
+                   '--frames', str(frames + warmup),
+                   '--bench-json', bench_json,
+                   '--bench-warmup', str(warmup)]
+        if trace_alloc:
+            command.append('--bench-trace-alloc')
+
+        try:
+            process = subprocess.run(command, cwd=os.path.dirname(path), capture_output=True,
+                                     text=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return {'status': 'timeout'}
+
+        if process.returncode != 0 or not os.path.exists(bench_json):
+            output = (process.stdout + process.stderr).strip().splitlines()
+            return {'status': 'failed', 'returncode': process.returncode, 'output': output[-5:]}
+
+        with open(bench_json) as bench_file:
+            frame_data = json.load(bench_file)
+
+    return {
+        'status': 'ok',
+        'frames': len(frame_data['frame_ms']),
+        'renderer': frame_data['renderer'],
+        'frame_ms': summarize(frame_data['frame_ms']),
+        'gl_calls_per_frame': summarize(frame_data['gl_calls']),
+        'gc_collections_per_frame': summarize(frame_data['gc_collections']),
+        'net_allocated_blocks_per_frame': summarize(frame_data['net_allocated_blocks']),
+        'allocated_bytes_per_frame': summarize(frame_data['allocated_bytes'] or []),
+    }
+
+# Relative change in percent, for the comparison table
+def change(new, old):
+    if not old:
+        return ""
+    return f"{100.0 * (new - old) / old:+.1f}%"
+
+def print_results(results, baseline=None):
+    print(f"{'demo':40} {'mean ms':>9} {'p50':>8} {'p95':>8} {'p99':>8} {'GL calls':>10} {'net blks':>8}")
+    for name, result in results['demos'].items():
+        if result['status'] != 'ok':
+            print(f"{name:40} {result['status']}")
+            continue
+        frame_ms = result['frame_ms']
+        print(f"{name:40} {frame_ms['mean']:9.2f} {frame_ms['p50']:8.2f} {frame_ms['p95']:8.2f} {frame_ms['p99']:8.2f}"
+              f" {result['gl_calls_per_frame']['mean']:10.0f} {result['net_allocated_blocks_per_frame']['mean']:8.1f}")
+
+        old = (baseline or {}).get('demos', {}).get(name)
+        if old and old.get('status') == 'ok':
+            print(f"{'  vs. baseline':40} {change(frame_ms['mean'], old['frame_ms']['mean']):>9}"
+                  f" {change(frame_ms['p50'], old['frame_ms']['p50']):>8}"
+                  f" {change(frame_ms['p95'], old['frame_ms']['p95']):>8}"
+                  f" {change(frame_ms['p99'], old['frame_ms']['p99']):>8}"
+                  f" {change(result['gl_calls_per_frame']['mean'], old['gl_calls_per_frame']['mean']):>10}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless frame-time benchmark for the Cube Libre demos.")
+    parser.add_argument('demos', nargs='*', help="demo scripts to run (default: cube_libre.py and all of tests/)")
+    parser.add_argument('--frames', type=int, default=300, help="measured frames per demo (default: 300)")
+    parser.add_argument('--warmup', type=int, default=30, help="frames to run before measuring (default: 30)")
+    parser.add_argument('--timeout', type=float, default=600.0, help="seconds before a demo is given up on")
+    parser.add_argument('--trace-alloc', action='store_true',
+                        help="also trace allocated bytes per frame with tracemalloc (slows the frames down)")
+    parser.add_argument('--output', default='benchmark_results.json', help="where to write the JSON results")
+    parser.add_argument('--compare', default=None, help="earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    demos = [os.path.abspath(path) for path in args.demos] or find_demos()
+    results = {
+        'version': results_version,
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'frames': args.frames,
+        'warmup': args.warmup,
+        'trace_alloc': args.trace_alloc,
+        'demos': {},
+    }
+
+    for path in demos:
+        name = os.path.relpath(path, repo_dir)
+        print(f"[INFO] Benchmarking {name}...")
+        results['demos'][name] = run_demo(path, args.frames, args.warmup, args.timeout, args.trace_alloc)
+
+    with open(args.output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"[INFO] Results written to {args.output}")
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+    print_results(results, baseline)
+
+if __name__ == '__main__':
+    main()
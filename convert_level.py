@@ -0,0 +1,104 @@
+# Level converter for Cube Libre
+#
+# Turns a human-readable level description (JSON, or TOML on Python 3.11+) into
+# the binary level format that cube_libre.py streams from (see LevelFile in
+# cube_level.py). A description looks like this in TOML:
+#
+#   chunk_size = 10.0                      # Edge of a streaming chunk (default: 10)
+#   start_position = [-18.0, 0.0, -18.0]   # Where the body starts
+#   horizon_y = -5.0
+#   grid = { extent = 20.0, step = 2.0 }   # The wireframe horizon grid
+#
+#   [[obstacles]]                          # Axis-aligned boxes
+#   min = [-4.0, -5.0, -4.0]
+#   max = [4.0, 1.0, -3.0]
+#
+#   [[lasers]]                             # Beams; sweep and period are optional
+#   start = [-10.0, 0.0, 0.0]
+#   end = [10.0, 0.0, 0.0]
+#   sweep = [0.0, 0.0, 4.0]                # Moves back and forth by this much...
+#   period = 3.0                           # ...every this many seconds
+#
+#   [[portals]]
+#   position = [18.0, 0.0, -18.0]
+#   size = 5.0
+#
+# Usage:
+#   python3 convert_level.py levels/laser_maze.toml                 # writes levels/laser_maze.cubelevel
+#   python3 convert_level.py maze.json --output /tmp/maze.cubelevel
+#   CUBE_LIBRE_LEVEL=levels/laser_maze.cubelevel python3 cube_libre.py
+#
+# https://github.com/FlyingFathead/pygame-opengl-polygon-demos
+
+import argparse
+import json
+import os
+import sys
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    tomllib = None
+
+import numpy as np
+
+import cube_level
+
+def read_description(path):
+    if path.endswith('.toml'):
+        if tomllib is None:
+            sys.exit("[ERROR] TOML level descriptions need Python 3.11 or newer; use JSON instead.")
+        with open(path, 'rb') as description_file:
+            return tomllib.load(description_file)
+    with open(path) as description_file:
+        return json.load(description_file)
+
+# The [x, y, z] values of one key from every item, as an (n, 3) array
+def vectors(items, key, default=None):
+    values = [item[key] if default is None else item.get(key, default) for item in items]
+    return np.array(values, dtype=np.float32).reshape(-1, 3)
+
+def convert(description, output_path):
+    obstacles = description.get('obstacles', [])
+    lasers = description.get('lasers', [])
+    portals = description.get('portals', [])
+    grid = description.get('grid', {})
+
+    laser_data = np.zeros(len(lasers), dtype=cube_level.level_laser_dtype)
+    laser_data['start'] = vectors(lasers, 'start')
+    laser_data['end'] = vectors(lasers, 'end')
+    laser_data['sweep'] = vectors(lasers, 'sweep', (0.0, 0.0, 0.0))
+    laser_data['period'] = [laser.get('period', 1.0) for laser in lasers]
+    portal_data = np.zeros(len(portals), dtype=cube_level.level_portal_dtype)
+    portal_data['position'] = vectors(portals, 'position')
+    portal_data['size'] = [portal.get('size', 5.0) for portal in portals]
+
+    cube_level.LevelFile.write(output_path,
+                                obstacles=np.stack([vectors(obstacles, 'min'), vectors(obstacles, 'max')], axis=1),
+                                lasers=laser_data, portals=portal_data,
+                                chunk_size=description.get('chunk_size', 10.0),
+                                start_position=description.get('start_position', (0.0, 0.0, 0.0)),
+                                horizon_y=description.get('horizon_y', -5.0),
+                                grid_extent=grid.get('extent', 20.0), grid_step=grid.get('step', 2.0))
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a JSON or TOML level description to a binary Cube Libre level.")
+    parser.add_argument('description', help="level description (.json or .toml)")
+    parser.add_argument('--output', default=None, help="level file to write (default: the description's name with .cubelevel)")
+    args = parser.parse_args()
+
+    output_path = args.output or os.path.splitext(args.description)[0] + '.cubelevel'
+    try:
+        convert(read_description(args.description), output_path)
+    except KeyError as e:
+        sys.exit(f"[ERROR] Invalid level description {args.description}: missing {e}")
+    except (ValueError, TypeError) as e:
+        sys.exit(f"[ERROR] Invalid level description {args.description}: {e}")
+
+    level = cube_level.LevelFile(output_path)
+    print(f"[INFO] Wrote {output_path}: {len(level.obstacles)} obstacles, {len(level.lasers)} lasers, "
+          f"{len(level.portals)} portals in {len(level.index)} "
+          f"chunks of {level.chunk_size:g} units")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1163 @@
+# Shared helpers for the Cube Libre demos
+#
+# Import this module *before* pygame and OpenGL. When a demo is started with
+# --headless (or CUBE_HEADLESS=1) it switches SDL and PyOpenGL over to an
+# offscreen EGL context (Mesa's surfaceless platform, so llvmpipe works without
+# a display or a GPU) and renders every frame into a framebuffer object.
+#
+# It also holds the pieces of scene geometry and the effects the demos share
+# (HorizonGrid, Starfield, GradientLUT, ScreenTransition), the broadphase index for world
+# obstacles (SpatialHash), batched segment-versus-box tests
+# (boxes_hit_by_segments), levels streamed in chunks from disk (ChunkedWorld,
+# reading the level formats of cube_level.py), cube body bookkeeping
+# (CubeCounts), the game log
+# (`log`) and the core-profile rendering helpers: the Camera uniform block with
+# NumPy matrices, the program cache (`shader_cache`), triangle index buffers
+# for quad geometry (quad_indices) and view-frustum culling (FrustumCuller).
+#
+# Options for every demo:
+#   --log-level LEVEL   DEBUG, INFO (default), WARNING, ERROR or OFF; also CUBE_LOG_LEVEL
+#
+# Headless options (ignored otherwise):
+#   --frames N          exit cleanly after N frames
+#   --capture DIR       save rendered frames as PNG files into DIR
+#   --capture-every N   only save every Nth frame (default: 1)
+#   --bench-json FILE   collect per-frame statistics and write them to FILE on exit
+#                       (used by benchmark.py; frames then run back to back)
+#   --bench-warmup N    leave the first N frames out of the statistics
+#   --bench-trace-alloc also trace Python memory allocations (slower)
+#
+# https://github.com/FlyingFathead/pygame-opengl-polygon-demos
+
+import argparse
+import collections
+import ctypes
+import gc
+import json
+import math
+import os
+import queue
+import sys
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+parser = argparse.ArgumentParser(add_help=False)
+parser.add_argument('--headless', action='store_true')
+parser.add_argument('--frames', type=int, default=0)
+parser.add_argument('--capture', default=None)
+parser.add_argument('--capture-every', type=int, default=1)
+parser.add_argument('--bench-json', default=None)
+parser.add_argument('--bench-warmup', type=int, default=0)
+parser.add_argument('--bench-trace-alloc', action='store_true')
+parser.add_argument('--log-level', default=os.environ.get('CUBE_LOG_LEVEL', 'INFO'))
+options, _ = parser.parse_known_args(sys.argv[1:])
+
+headless = options.headless or os.environ.get('CUBE_HEADLESS', '0') == '1'
+benchmarking = headless and options.bench_json is not None
+
+# Leveled game log for the hot paths (collisions, destruction, movement)
+#
+# Messages below the level cost one comparison; call sites in tight loops
+# check debug_enabled first so not even the arguments are built. Each message
+# format is rate limited, and count() aggregates events into one summary line
+# per summary_interval (e.g. "42 horizon collisions") instead of one line each.
+class GameLog:
+    levels = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40, 'OFF': 100}
+
+    def __init__(self, level='INFO', rate_limit=10, summary_interval=1.0):
+        self.rate_limit = rate_limit  # Lines per message format per summary_interval
+        self.summary_interval = summary_interval  # Seconds (0 = summarize every frame)
+        self.counters = {}
+        self.message_counts = {}  # Message format -> lines this interval
+        self.suppressed = 0
+        self.interval_start = time.perf_counter()
+        self.set_level(level)
+
+    def set_level(self, level):
+        self.level = self.levels[level.upper()] if isinstance(level, str) else level
+        self.debug_enabled = self.level <= self.levels['DEBUG']
+        self.counting = self.level <= self.levels['INFO']
+
+    def log(self, level, message, *args, **fields):
+        if self.levels[level] < self.level:
+            return
+        lines = self.message_counts.get(message, 0)
+        if lines >= self.rate_limit:
+            self.suppressed += 1
+            return
+        self.message_counts[message] = lines + 1
+        if args:
+            message = message % args
+        if fields:
+            message += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        print(f"[{level}] {message}")
+
+    def debug(self, message, *args, **fields):
+        if self.debug_enabled:
+            self.log('DEBUG', message, *args, **fields)
+
+    def info(self, message, *args, **fields):
+        self.log('INFO', message, *args, **fields)
+
+    def warning(self, message, *args, **fields):
+        self.log('WARNING', message, *args, **fields)
+
+    def error(self, message, *args, **fields):
+        self.log('ERROR', message, *args, **fields)
+
+    # Add to an aggregated counter, reported in the next summary line
+    def count(self, name, amount=1):
+        if self.counting:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    # Called once per frame (by flip): print the summary when the interval is over
+    def end_frame(self):
+        now = time.perf_counter()
+        if now - self.interval_start < self.summary_interval:
+            return
+        if self.counters or self.suppressed:
+            parts = [f"{value} {name}" for name, value in self.counters.items()]
+            if self.suppressed:
+                parts.append(f"{self.suppressed} log lines suppressed")
+            interval = "this frame" if self.summary_interval == 0 else f"in the last {now - self.interval_start:.1f} s"
+            print(f"[INFO] {', '.join(parts)} {interval}")
+            self.counters.clear()
+            self.suppressed = 0
+        self.message_counts.clear()
+        self.interval_start = now
+
+log = GameLog(options.log_level)
+
+# These have to be set before pygame / PyOpenGL pick their platform
+if headless:
+    os.environ.setdefault('SDL_VIDEODRIVER', 'offscreen')
+    os.environ.setdefault('PYOPENGL_PLATFORM', 'egl')
+    os.environ.setdefault('EGL_PLATFORM', 'surfaceless')
+
+import pygame
+from pygame.locals import DOUBLEBUF, OPENGL
+import OpenGL.GL
+import OpenGL.GLU
+from OpenGL.GL import *
+from OpenGL.GL import shaders
+
+frame_number = 0  # Frames presented so far
+offscreen_framebuffer = None  # FBO that headless OpenGL frames are rendered into
+offscreen_size = (0, 0)
+
+# Per-frame statistics gathered in benchmark mode
+gl_call_count = 0
+gc_collection_count = 0
+bench_frame_times = []
+bench_gl_calls = []
+bench_gc_collections = []
+bench_net_allocated_blocks = []
+bench_allocated_bytes = []
+bench_last_flip = None
+bench_last_blocks = 0
+
+# Wrap an OpenGL function so that every call is counted
+def counted_gl_function(function):
+    def counted(*args, **kwargs):
+        global gl_call_count
+        gl_call_count += 1
+        return function(*args, **kwargs)
+    counted.__name__ = function.__name__
+    return counted
+
+# Count garbage collector runs (gc.callbacks reports a start and a stop per run)
+def count_gc_collection(phase, info):
+    global gc_collection_count
+    if phase == 'start':
+        gc_collection_count += 1
+
+pacing_clock = pygame.time.Clock
+
+# pygame.time.Clock without the frame rate cap, so benchmarks measure work, not sleep
+class UnpacedClock:
+    def __init__(self):
+        self.clock = pacing_clock()
+
+    def tick(self, framerate=0):
+        return self.clock.tick()
+
+    def __getattr__(self, name):
+        return getattr(self.clock, name)
+
+if benchmarking:
+    # Demos star-import OpenGL after this module, so they pick up the counted versions
+    for module in (OpenGL.GL, OpenGL.GLU):
+        for name in dir(module):
+            function = getattr(module, name)
+            if name.startswith('gl') and callable(function):
+                setattr(module, name, counted_gl_function(function))
+                if name in globals():
+                    globals()[name] = getattr(module, name)  # Count our own calls too
+
+    # Render frames back to back
+    pygame.time.Clock = UnpacedClock
+    pygame.time.wait = lambda milliseconds: 0
+    pygame.time.delay = lambda milliseconds: 0
+
+    gc.callbacks.append(count_gc_collection)
+    if options.bench_trace_alloc:
+        tracemalloc.start()
+
+# Create the window, or an offscreen framebuffer of the same size when headless
+def set_mode(size, flags=DOUBLEBUF | OPENGL):
+    surface = pygame.display.set_mode(size, flags)
+    if headless and flags & OPENGL:
+        create_offscreen_framebuffer(size)
+    return surface
+
+# Color + depth framebuffer object that replaces the window in headless mode
+def create_offscreen_framebuffer(size):
+    global offscreen_framebuffer, offscreen_size
+    width, height = size
+
+    color_buffer = glGenRenderbuffers(1)
+    glBindRenderbuffer(GL_RENDERBUFFER, color_buffer)
+    glRenderbufferStorage(GL_RENDERBUFFER, GL_RGBA8, width, height)
+
+    depth_buffer = glGenRenderbuffers(1)
+    glBindRenderbuffer(GL_RENDERBUFFER, depth_buffer)
+    glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH_COMPONENT24, width, height)
+    glBindRenderbuffer(GL_RENDERBUFFER, 0)
+
+    offscreen_framebuffer = glGenFramebuffers(1)
+    glBindFramebuffer(GL_FRAMEBUFFER, offscreen_framebuffer)
+    glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_RENDERBUFFER, color_buffer)
+    glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_RENDERBUFFER, depth_buffer)
+
+    status = glCheckFramebufferStatus(GL_FRAMEBUFFER)
+    if status != GL_FRAMEBUFFER_COMPLETE:
+        raise RuntimeError(f"Offscreen framebuffer is incomplete (status 0x{status:x})")
+
+    glViewport(0, 0, width, height)
+    offscreen_size = (width, height)
+    print(f"[INFO] Headless mode: rendering {width}x{height} offscreen with {glGetString(GL_RENDERER).decode()}")
+
+# Compile and link a shader program with fixed attribute locations; with
+# feedback_varyings (and usually no fragment shader) the listed outputs are
+# captured, interleaved, by transform feedback
+def compile_shader_program(vertex_source, fragment_source, attributes, feedback_varyings=()):
+    program = glCreateProgram()
+    glAttachShader(program, shaders.compileShader(vertex_source, GL_VERTEX_SHADER))
+    if fragment_source is not None:
+        glAttachShader(program, shaders.compileShader(fragment_source, GL_FRAGMENT_SHADER))
+    for location, name in enumerate(attributes):
+        glBindAttribLocation(program, location, name)
+    if feedback_varyings:
+        names = [ctypes.c_char_p(name.encode()) for name in feedback_varyings]
+        name_array = (ctypes.POINTER(ctypes.c_char) * len(names))(
+            *[ctypes.cast(name, ctypes.POINTER(ctypes.c_char)) for name in names])
+        glTransformFeedbackVaryings(program, len(names), name_array, GL_INTERLEAVED_ATTRIBS)
+    glLinkProgram(program)
+    if glGetProgramiv(program, GL_LINK_STATUS) != GL_TRUE:
+        raise RuntimeError(glGetProgramInfoLog(program).decode())
+    return program
+
+# 4x4 matrices for column vectors, as OpenGL uses them (row-major NumPy arrays)
+def perspective_matrix(fov_y, aspect, near, far):
+    f = 1.0 / math.tan(math.radians(fov_y) / 2)
+    return np.array([[f / aspect, 0.0, 0.0, 0.0],
+                     [0.0, f, 0.0, 0.0],
+                     [0.0, 0.0, (far + near) / (near - far), 2 * far * near / (near - far)],
+                     [0.0, 0.0, -1.0, 0.0]])
+
+def translation_matrix(x, y, z):
+    matrix = np.identity(4)
+    matrix[:3, 3] = (x, y, z)
+    return matrix
+
+# Rotation by angle degrees about the axis (x, y, z), like glRotatef
+def rotation_matrix(angle, x, y, z):
+    axis = np.array([x, y, z], dtype=np.float64)
+    axis /= np.linalg.norm(axis)
+    c = math.cos(math.radians(angle))
+    s = math.sin(math.radians(angle))
+    cross = np.array([[0.0, -axis[2], axis[1]], [axis[2], 0.0, -axis[0]], [-axis[1], axis[0], 0.0]])
+    matrix = np.identity(4)
+    matrix[:3, :3] = c * np.identity(3) + s * cross + (1 - c) * np.outer(axis, axis)
+    return matrix
+
+# Uniform block every core-profile shader starts with (bound to camera_binding)
+camera_binding = 0
+core_shader_header = """#version 330 core
+layout(std140) uniform Camera {
+    mat4 view_projection;
+};
+"""
+
+# Camera matrices computed in NumPy and shared by all programs through one
+# uniform buffer, so a frame uploads them once instead of every draw
+# validating the fixed-function matrix stack. With fixed_function (only in a
+# compatibility context) the matrix stack is kept in step as well, for
+# immediate-mode fallback paths.
+class Camera:
+    def __init__(self, fov_y, aspect, near, far, fixed_function=False):
+        self.projection = perspective_matrix(fov_y, aspect, near, far)
+        self.fixed_function = fixed_function
+        self.ubo = glGenBuffers(1)
+        glBindBuffer(GL_UNIFORM_BUFFER, self.ubo)
+        glBufferData(GL_UNIFORM_BUFFER, 64, None, GL_DYNAMIC_DRAW)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+        glBindBufferBase(GL_UNIFORM_BUFFER, camera_binding, self.ubo)
+        if fixed_function:
+            glMatrixMode(GL_PROJECTION)
+            glLoadMatrixd(self.projection.T)
+            glMatrixMode(GL_MODELVIEW)
+        self.set_view(np.identity(4))
+
+    # Set the view matrix and upload the view-projection matrix
+    def set_view(self, view):
+        self.view = view
+        self.view_projection = self.projection @ view
+        data = np.ascontiguousarray(self.view_projection.T, dtype=np.float32)  # GLSL matrices are column-major
+        glBindBuffer(GL_UNIFORM_BUFFER, self.ubo)
+        glBufferSubData(GL_UNIFORM_BUFFER, 0, data.nbytes, data)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+        if self.fixed_function:
+            glLoadMatrixd(view.T)
+
+# Shader programs by source, each compiled and linked once however many
+# renderers ask for it; programs that use the Camera block get it bound
+class ShaderCache:
+    def __init__(self):
+        self.programs = {}
+
+    def get(self, vertex_source, fragment_source, attributes, feedback_varyings=()):
+        key = (vertex_source, fragment_source, tuple(attributes), tuple(feedback_varyings))
+        program = self.programs.get(key)
+        if program is None:
+            program = compile_shader_program(vertex_source, fragment_source, attributes, feedback_varyings)
+            block = glGetUniformBlockIndex(program, 'Camera')
+            if block != GL_INVALID_INDEX:
+                glUniformBlockBinding(program, block, camera_binding)
+            self.programs[key] = program
+        return program
+
+shader_cache = ShaderCache()
+
+# Triangle indices (two triangles per quad) for quad_count quads of 4 vertices each
+def quad_indices(quad_count):
+    corners = np.array([0, 1, 2, 0, 2, 3], dtype=np.uint32)
+    return (np.arange(quad_count, dtype=np.uint32)[:, None] * 4 + corners).ravel()
+
+# Upload indices into an element buffer attached to the currently bound VAO
+def create_index_buffer(indices, usage=GL_STATIC_DRAW):
+    buffer = glGenBuffers(1)
+    glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, buffer)
+    glBufferData(GL_ELEMENT_ARRAY_BUFFER, indices.nbytes, indices, usage)
+    return buffer
+
+# View-frustum culling of axis-aligned boxes
+#
+# update() extracts the six frustum planes from the camera's view-projection
+# matrix once per frame. visible() tests a whole array of boxes in one
+# vectorized pass (a box is outside if its corner furthest along some plane's
+# normal is behind that plane) and counts how many boxes of each kind were
+# tested and culled, for take_stats().
+class FrustumCuller:
+    def __init__(self):
+        self.planes = np.zeros((6, 4))
+        self.tested = {}
+        self.culled = {}
+
+    def update(self, view_projection):
+        m = view_projection
+        planes = np.array([m[3] + m[0], m[3] - m[0], m[3] + m[1], m[3] - m[1], m[3] + m[2], m[3] - m[2]])
+        self.planes = planes / np.linalg.norm(planes[:, :3], axis=1)[:, None]
+
+    # Mask of the boxes (min and max corners as (n, 3) arrays) inside or touching the frustum
+    def visible(self, kind, box_min, box_max):
+        normals = self.planes[:, :3]
+        corners = np.where(normals[:, None, :] >= 0, box_max[None], box_min[None])
+        distances = np.einsum('pnk,pk->pn', corners, normals) + self.planes[:, 3:]
+        mask = (distances >= 0).all(axis=0)
+        self.tested[kind] = self.tested.get(kind, 0) + len(mask)
+        self.culled[kind] = self.culled.get(kind, 0) + len(mask) - np.count_nonzero(mask)
+        return mask
+
+    # Culled share of every kind (and of all boxes together) since the last call
+    def take_stats(self):
+        stats = {kind: self.culled[kind] / tested for kind, tested in self.tested.items() if tested}
+        total = sum(self.tested.values())
+        stats['total'] = sum(self.culled.values()) / total if total else 0.0
+        self.tested.clear()
+        self.culled.clear()
+        return stats
+
+# Core-profile shaders for single-colored geometry in world coordinates
+line_vertex_shader = core_shader_header + """
+in vec3 position;
+void main() {
+    gl_Position = view_projection * vec4(position, 1.0);
+}
+"""
+
+color_fragment_shader = """#version 330 core
+uniform vec4 color;
+out vec4 frag_color;
+void main() {
+    frag_color = color;
+}
+"""
+
+# Wireframe horizon grid: built once into a static VBO, drawn with one call
+#
+# Lines run from -extent to extent in x and z every `step` units at height y,
+# so bigger or denser grids cost no extra Python work per frame. With a camera
+# the grid is drawn by a core-profile shader instead of the fixed pipeline.
+# The grid is cut into chunks x chunks square pieces stored one after another,
+# so that draw() with a FrustumCuller submits only the pieces in view.
+class HorizonGrid:
+    def __init__(self, extent=20.0, step=2.0, y=-5.0, color=(1.0, 1.0, 1.0), line_width=1, camera=None,
+                 chunks=1):
+        self.color = color
+        self.line_width = line_width
+        self.program = None
+        if camera is not None:
+            self.program = shader_cache.get(line_vertex_shader, color_fragment_shader, ['position'])
+            self.color_location = glGetUniformLocation(self.program, 'color')
+
+        lines = np.linspace(-extent, extent, int(round(2 * extent / step)) + 1)
+        edges = np.linspace(-extent, extent, chunks + 1)
+        # Every line belongs to the chunk row it starts in (the last line to the last row)
+        line_chunk = np.minimum(((lines + extent) / (edges[1] - edges[0]) + 1e-9).astype(int), chunks - 1)
+        pieces = []
+        chunk_min = []
+        chunk_max = []
+        for chunk_x in range(chunks):
+            x0, x1 = edges[chunk_x], edges[chunk_x + 1]
+            for chunk_z in range(chunks):
+                z0, z1 = edges[chunk_z], edges[chunk_z + 1]
+                z_lines = lines[line_chunk == chunk_z]
+                x_lines = lines[line_chunk == chunk_x]
+                piece = np.empty((len(z_lines) + len(x_lines), 2, 3), dtype=np.float32)
+                piece[..., 1] = y
+                # Horizontal lines (constant z) across this chunk
+                piece[:len(z_lines), 0, 0] = x0
+                piece[:len(z_lines), 1, 0] = x1
+                piece[:len(z_lines), :, 2] = z_lines[:, None]
+                # Vertical lines (constant x) across this chunk
+                piece[len(z_lines):, :, 0] = x_lines[:, None]
+                piece[len(z_lines):, 0, 2] = z0
+                piece[len(z_lines):, 1, 2] = z1
+                pieces.append(piece.reshape(-1, 3))
+                chunk_min.append((x0, y, z0))
+                chunk_max.append((x1, y, z1))
+        vertices = np.concatenate(pieces)
+        self.vertex_count = len(vertices)
+        self.chunk_counts = np.array([len(piece) for piece in pieces], dtype=np.int32)
+        self.chunk_firsts = (np.cumsum(self.chunk_counts) - self.chunk_counts).astype(np.int32)
+        self.chunk_min = np.array(chunk_min)
+        self.chunk_max = np.array(chunk_max)
+
+        self.vao = glGenVertexArrays(1)
+        glBindVertexArray(self.vao)
+        self.vbo = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL_STATIC_DRAW)
+        glEnableVertexAttribArray(0)  # Attribute 0 aliases the fixed-function vertex position
+        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 3 * 4, ctypes.c_void_p(0))
+        glBindVertexArray(0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    # Draw the whole grid, or only the chunks a FrustumCuller sees
+    def draw(self, culler=None):
+        glLineWidth(self.line_width)
+        if self.program is not None:
+            glUseProgram(self.program)
+            glUniform4f(self.color_location, *self.color, 1.0)
+        else:
+            glColor3f(*self.color)
+        glBindVertexArray(self.vao)
+        if culler is None:
+            glDrawArrays(GL_LINES, 0, self.vertex_count)
+        else:
+            visible = culler.visible('grid', self.chunk_min, self.chunk_max)
+            if visible.any():
+                glMultiDrawArrays(GL_LINES, self.chunk_firsts[visible], self.chunk_counts[visible],
+                                  np.count_nonzero(visible))
+        glBindVertexArray(0)
+        if self.program is not None:
+            glUseProgram(0)
+
+starfield_vertex_shader = """
+#version 120
+attribute vec3 position;
+uniform vec3 star_offset;
+uniform float extent;
+void main() {
+    // Scroll every star by the same offset and wrap it back into the box
+    vec3 star = mod(position + star_offset + extent, 2.0 * extent) - extent;
+    gl_FrontColor = gl_Color;
+    gl_Position = gl_ModelViewProjectionMatrix * vec4(star, 1.0);
+}
+"""
+
+starfield_fragment_shader = """
+#version 120
+void main() {
+    gl_FragColor = gl_Color;
+}
+"""
+
+# The same wrap-around for the core-profile camera (colored by the color uniform)
+starfield_core_vertex_shader = core_shader_header + """
+in vec3 position;
+uniform vec3 star_offset;
+uniform float extent;
+void main() {
+    vec3 star = mod(position + star_offset + extent, 2.0 * extent) - extent;
+    gl_Position = view_projection * vec4(star, 1.0);
+}
+"""
+
+# Star points uploaded once; scrolling is a single uniform, wrapped in the shader
+#
+# Stars fill the box from -extent to extent on every axis. scroll() only moves
+# one offset, so the per-frame cost does not depend on the number of stars.
+# With a camera the stars are drawn in `color` by a core-profile shader;
+# otherwise they take the current glColor. The stars are sorted into
+# tiles x tiles x tiles boxes, so draw() with a FrustumCuller submits only the
+# tiles in view.
+class Starfield:
+    def __init__(self, count=1000, extent=50.0, point_size=2, camera=None, color=(1.0, 1.0, 1.0), tiles=1):
+        self.count = count
+        self.extent = extent
+        self.point_size = point_size
+        self.color = color
+        self.offset = np.zeros(3)
+        self.color_location = -1
+
+        positions = np.random.uniform(-extent, extent, (count, 3)).astype(np.float32)
+        self.tile_size = 2 * extent / tiles
+        tile_coords = np.minimum(((positions + extent) / self.tile_size).astype(int), tiles - 1)
+        tile_of_star = (tile_coords[:, 0] * tiles + tile_coords[:, 1]) * tiles + tile_coords[:, 2]
+        positions = positions[np.argsort(tile_of_star, kind='stable')]
+        self.tile_counts = np.bincount(tile_of_star, minlength=tiles ** 3).astype(np.int32)
+        self.tile_firsts = (np.cumsum(self.tile_counts) - self.tile_counts).astype(np.int32)
+        corners = np.arange(tiles) * self.tile_size - extent
+        grid_x, grid_y, grid_z = np.meshgrid(corners, corners, corners, indexing='ij')
+        self.tile_min = np.stack([grid_x.ravel(), grid_y.ravel(), grid_z.ravel()], axis=1)
+        self.vao = glGenVertexArrays(1)
+        glBindVertexArray(self.vao)
+        self.vbo = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glBufferData(GL_ARRAY_BUFFER, positions.nbytes, positions, GL_STATIC_DRAW)
+        glEnableVertexAttribArray(0)
+        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 3 * 4, ctypes.c_void_p(0))
+        glBindVertexArray(0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+        if camera is not None:
+            self.program = shader_cache.get(starfield_core_vertex_shader, color_fragment_shader, ['position'])
+            self.color_location = glGetUniformLocation(self.program, 'color')
+            self.offset_location = glGetUniformLocation(self.program, 'star_offset')
+            self.extent_location = glGetUniformLocation(self.program, 'extent')
+            return
+        try:
+            self.program = compile_shader_program(starfield_vertex_shader, starfield_fragment_shader, ['position'])
+            self.offset_location = glGetUniformLocation(self.program, 'star_offset')
+            self.extent_location = glGetUniformLocation(self.program, 'extent')
+        except (OpenGL.error.GLError, OpenGL.error.NullFunctionError, RuntimeError) as e:
+            log.warning("Starfield shader unavailable, stars will not wrap around: %s", e)
+            self.program = None
+
+    # Move every star by (dx, dy, dz)
+    def scroll(self, dx, dy, dz):
+        self.offset = (self.offset + (dx, dy, dz)) % (2 * self.extent)
+
+    # Current world boxes of the tiles; a tile split by the wrap-around covers the whole axis
+    def tile_bounds(self):
+        extent = self.extent
+        low = np.mod(self.tile_min + self.offset + extent, 2 * extent) - extent
+        high = low + self.tile_size
+        split = high > extent + 1e-6
+        return np.where(split, -extent, low), np.where(split, extent, high)
+
+    # Draw every star, or only the tiles a FrustumCuller sees
+    def draw(self, culler=None):
+        glPointSize(self.point_size)
+        glBindVertexArray(self.vao)
+        if self.program is not None:
+            glUseProgram(self.program)
+            glUniform3f(self.offset_location, *self.offset)
+            glUniform1f(self.extent_location, self.extent)
+            if self.color_location != -1:
+                glUniform4f(self.color_location, *self.color, 1.0)
+            if culler is None:
+                glDrawArrays(GL_POINTS, 0, self.count)
+            else:
+                visible = culler.visible('stars', *self.tile_bounds())
+                if visible.any():
+                    glMultiDrawArrays(GL_POINTS, self.tile_firsts[visible], self.tile_counts[visible],
+                                      np.count_nonzero(visible))
+            glUseProgram(0)
+        else:
+            glPushMatrix()
+            glTranslatef(*self.offset)
+            glDrawArrays(GL_POINTS, 0, self.count)
+            glPopMatrix()
+        glBindVertexArray(0)
+
+# Color gradients as (position, (r, g, b)) stops; position 0 is the bottom of
+# the gradient's y range and 1 the top
+gradient_palettes = {
+    'classic': [(0.0, (1.0, 0.0, 0.0)), (1.0, (0.0, 0.0, 1.0))],
+    'sunset': [(0.0, (0.3, 0.0, 0.4)), (0.4, (0.9, 0.2, 0.3)), (0.7, (1.0, 0.6, 0.1)), (1.0, (1.0, 0.9, 0.4))],
+    'ocean': [(0.0, (0.0, 0.1, 0.3)), (0.5, (0.0, 0.5, 0.7)), (1.0, (0.6, 1.0, 0.9))],
+    'rainbow': [(0.0, (1.0, 0.0, 0.0)), (0.2, (1.0, 0.6, 0.0)), (0.4, (1.0, 1.0, 0.0)),
+                (0.6, (0.0, 0.8, 0.0)), (0.8, (0.0, 0.4, 1.0)), (1.0, (0.5, 0.0, 0.8))],
+}
+
+# A color gradient over y, precomputed into a 1D lookup table
+#
+# The stops are interpolated once into `resolution` colors between y_min and
+# y_max (clamped outside), so coloring a cube is one table lookup however many
+# stops there are. color() serves per-cube loops, colors() arrays of y, and
+# create_texture() puts the same table into a 1D texture for shaders.
+class GradientLUT:
+    def __init__(self, stops, y_min, y_max, resolution=256):
+        self.y_min = y_min
+        self.y_max = y_max
+        self.resolution = resolution
+        self.scale = (resolution - 1) / (y_max - y_min)  # Table entries per unit of y
+        self.table = np.empty((resolution, 3), dtype=np.float32)
+        self.texture = None
+        self.set_stops(stops)
+
+    # Recompute the table (and the texture, if there is one) for new stops
+    def set_stops(self, stops):
+        positions = [position for position, _ in stops]
+        stop_colors = np.array([color for _, color in stops], dtype=np.float64)
+        samples = np.linspace(0.0, 1.0, self.resolution)
+        for channel in range(3):
+            self.table[:, channel] = np.interp(samples, positions, stop_colors[:, channel])
+        self.rows = [tuple(row) for row in self.table.tolist()]
+        if self.texture is not None:
+            glBindTexture(GL_TEXTURE_1D, self.texture)
+            glTexSubImage1D(GL_TEXTURE_1D, 0, 0, self.resolution, GL_RGB, GL_FLOAT, self.table)
+            glBindTexture(GL_TEXTURE_1D, 0)
+
+    # Color at one y value
+    def color(self, y):
+        index = int((y - self.y_min) * self.scale + 0.5)
+        return self.rows[min(max(index, 0), self.resolution - 1)]
+
+    # Colors at an array of y values, as an (n, 3) float32 array
+    def colors(self, ys):
+        indices = np.rint((ys - self.y_min) * self.scale)
+        np.clip(indices, 0, self.resolution - 1, out=indices)
+        return self.table[indices.astype(np.intp)]
+
+    # Upload the table into a 1D texture (linear filtering, clamped at the ends)
+    def create_texture(self):
+        self.texture = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_1D, self.texture)
+        glTexParameteri(GL_TEXTURE_1D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_1D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_1D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexImage1D(GL_TEXTURE_1D, 0, GL_RGB32F, self.resolution, 0, GL_RGB, GL_FLOAT, self.table)
+        glBindTexture(GL_TEXTURE_1D, 0)
+        return self.texture
+
+    # Scale and bias that map a y value to its texture coordinate (texel centers)
+    def texture_transform(self):
+        scale = self.scale / self.resolution
+        return scale, 0.5 / self.resolution - self.y_min * scale
+
+# Live and destroyed cube counts of a cube body
+#
+# The body's destroy code reports every cube it destroys and its reset code
+# starts the counts over, so "is any cube destroyed" and "are all cubes
+# destroyed" are O(1) questions instead of scans over every cube.
+class CubeCounts:
+    def __init__(self, count):
+        self.count = count
+        self.reset()
+
+    # Every cube intact again
+    def reset(self):
+        self.live = self.count
+        self.destroyed = 0
+
+    def cube_destroyed(self):
+        self.live -= 1
+        self.destroyed += 1
+
+    @property
+    def all_destroyed(self):
+        return self.live == 0
+
+# Uniform grid index over world obstacles for broadphase collision queries
+#
+# Obstacles are axis-aligned boxes (min and max corners) filed under every
+# cell of the ground plane (x, z) they cover; y only takes part in the final
+# box test, so tall or bottomless obstacles are fine. A query with the body's
+# box looks at the few cells the body covers, so its cost depends on the
+# obstacles nearby, not on how many there are in the whole world.
+class SpatialHash:
+    def __init__(self, cell_size=4.0):
+        self.cell_size = cell_size
+        self.cells = {}  # (cell x, cell z) -> set of obstacle keys
+        self.boxes = {}  # obstacle key -> (min corner, max corner)
+
+    def cell_range(self, box_min, box_max):
+        x0, x1 = int(math.floor(box_min[0] / self.cell_size)), int(math.floor(box_max[0] / self.cell_size))
+        z0, z1 = int(math.floor(box_min[2] / self.cell_size)), int(math.floor(box_max[2] / self.cell_size))
+        return [(x, z) for x in range(x0, x1 + 1) for z in range(z0, z1 + 1)]
+
+    def insert(self, key, box_min, box_max):
+        if key in self.boxes:
+            self.remove(key)
+        self.boxes[key] = (tuple(box_min), tuple(box_max))
+        for cell in self.cell_range(box_min, box_max):
+            self.cells.setdefault(cell, set()).add(key)
+
+    def remove(self, key):
+        box_min, box_max = self.boxes.pop(key)
+        for cell in self.cell_range(box_min, box_max):
+            keys = self.cells[cell]
+            keys.discard(key)
+            if not keys:
+                del self.cells[cell]
+
+    # Re-file an obstacle that moved
+    def move(self, key, box_min, box_max):
+        self.insert(key, box_min, box_max)
+
+    # Keys of all obstacles whose boxes overlap the given box
+    def query(self, box_min, box_max):
+        found = []
+        seen = set()
+        for cell in self.cell_range(box_min, box_max):
+            for key in self.cells.get(cell, ()):
+                if key in seen:
+                    continue
+                seen.add(key)
+                obstacle_min, obstacle_max = self.boxes[key]
+                if all(obstacle_min[axis] <= box_max[axis] and box_min[axis] <= obstacle_max[axis] for axis in range(3)):
+                    found.append(key)
+        return found
+
+    def __len__(self):
+        return len(self.boxes)
+
+# Which of the boxes (min and max corners as (m, 3) arrays) any of the line
+# segments (start and end points as (n, 3) arrays) passes through.
+#
+# A slab test of every segment against every box at once: the segment is
+# clipped to each axis' slab of the box and hits if some part of it survives
+# all three. It runs in float32 one axis at a time on (segments, boxes) arrays,
+# max_pairs // m segments at a time, so thousands of segments against
+# thousands of boxes stay within a cache-sized working set.
+def boxes_hit_by_segments(starts, ends, box_min, box_max, max_pairs=1 << 16):
+    hit = np.zeros(len(box_min), dtype=bool)
+    if len(starts) == 0 or len(box_min) == 0:
+        return hit
+    directions = ends - starts
+    directions = np.where(np.abs(directions) < 1e-12, 1e-12, directions)  # Parallel to a slab: never crosses it
+    inverse = (1.0 / directions).astype(np.float32)
+    starts = starts.astype(np.float32)
+    box_min = np.ascontiguousarray(box_min.T, dtype=np.float32)  # One row per axis
+    box_max = np.ascontiguousarray(box_max.T, dtype=np.float32)
+    batch = max(1, max_pairs // len(hit))
+    for first in range(0, len(starts), batch):
+        origin = starts[first:first + batch]
+        scale = inverse[first:first + batch]
+        t_enter = np.zeros((len(origin), len(hit)), dtype=np.float32)
+        t_exit = np.ones((len(origin), len(hit)), dtype=np.float32)
+        for axis in range(3):
+            t_min = (box_min[axis] - origin[:, axis, None]) * scale[:, axis, None]
+            t_max = (box_max[axis] - origin[:, axis, None]) * scale[:, axis, None]
+            np.maximum(t_enter, np.minimum(t_min, t_max), out=t_enter)
+            np.minimum(t_exit, np.maximum(t_min, t_max, out=t_min), out=t_exit)
+        hit |= (t_enter <= t_exit).any(axis=0)
+    return hit
+
+# Line vertices of the 12 edges of every box in an (n, 2, 3) array of min and max corners
+box_corner_select = (np.arange(8)[:, None] >> np.arange(3)) & 1  # Corner c takes max on axis a if bit a of c is set
+box_edge_corners = np.array([(c, c | bit) for bit in (1, 2, 4) for c in range(8) if not c & bit]).ravel()
+
+def box_edge_vertices(boxes):
+    corners = boxes[:, box_corner_select, np.arange(3)]
+    return np.ascontiguousarray(corners[:, box_edge_corners].reshape(-1, 3), dtype=np.float32)
+
+# Faces of a box as quads of corner numbers (see box_corner_select), and
+# the same quads as triangle indices
+box_face_corners = np.array([(0, 4, 6, 2), (1, 3, 7, 5), (0, 1, 5, 4),
+                             (2, 6, 7, 3), (0, 2, 3, 1), (4, 5, 7, 6)], dtype=np.uint32)
+box_face_indices = box_face_corners[:, [0, 1, 2, 0, 2, 3]].ravel()
+
+unit_cube = None  # (vertex buffer, face index buffer, edge index buffer), made on first use
+
+# Draw a cube of the given edge length centered on the origin with the current
+# color and fixed-function matrices, from buffers shared by all callers (a
+# stand-in for glutSolidCube / glutWireCube, which need glutInit and a display)
+def draw_cube(size, wireframe=False):
+    global unit_cube
+    if unit_cube is None:
+        vertices = np.ascontiguousarray(box_corner_select - 0.5, dtype=np.float32)
+        vbo = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, vbo)
+        glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL_STATIC_DRAW)
+        unit_cube = (vbo, create_index_buffer(box_face_indices),
+                     create_index_buffer(box_edge_corners.astype(np.uint32)))
+    vbo, face_buffer, edge_buffer = unit_cube
+
+    glPushMatrix()
+    glScalef(size, size, size)
+    glBindBuffer(GL_ARRAY_BUFFER, vbo)
+    glEnableClientState(GL_VERTEX_ARRAY)
+    glVertexPointer(3, GL_FLOAT, 0, ctypes.c_void_p(0))
+    if wireframe:
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, edge_buffer)
+        glDrawElements(GL_LINES, len(box_edge_corners), GL_UNSIGNED_INT, None)
+    else:
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, face_buffer)
+        glDrawElements(GL_TRIANGLES, len(box_face_indices), GL_UNSIGNED_INT, None)
+    glDisableClientState(GL_VERTEX_ARRAY)
+    glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+    glBindBuffer(GL_ARRAY_BUFFER, 0)
+    glPopMatrix()
+
+# A level too large to hold at once, streamed in chunks around a point.
+#
+# update(position) asks for the chunks within load_radius chunks of the
+# position; a background thread reads them from `source` (a LevelFile, a
+# ChunkDirectory or anything with chunk_size, has_chunk(coord) and load(coord))
+# and prepares their vertices, and the main thread uploads at most
+# uploads_per_frame finished chunks per call. Loaded chunks stay cached until
+# more than `capacity` are resident, then the least recently wanted ones are
+# evicted, so memory and frame cost stay bounded however large the level is.
+# The obstacles of the resident chunks are filed in a SpatialHash
+# (`obstacles`, keyed by chunk and index) for collision queries (touching).
+class ChunkedWorld:
+    def __init__(self, source, load_radius=1, capacity=64, camera=None, color=(1.0, 0.5, 0.0), line_width=1,
+                 uploads_per_frame=2):
+        self.source = source
+        self.chunk_size = source.chunk_size
+        self.load_radius = load_radius
+        self.capacity = max(capacity, (2 * load_radius + 1) ** 3)
+        self.color = color
+        self.line_width = line_width
+        self.uploads_per_frame = uploads_per_frame
+        self.program = None
+        if camera is not None:
+            self.program = shader_cache.get(line_vertex_shader, color_fragment_shader, ['position'])
+            self.color_location = glGetUniformLocation(self.program, 'color')
+
+        # Chunk coordinate -> (VAO, VBO, vertex count, box min, box max), least recently wanted first
+        self.resident = collections.OrderedDict()
+        self.obstacles = SpatialHash(cell_size=self.chunk_size / 2)
+        self.pending = set()  # Requested, not yet uploaded
+        self.wanted = frozenset()  # Replaced (never changed in place) so the loader thread can read it
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.loader = threading.Thread(target=self.load_chunks, name='chunk loader', daemon=True)
+        self.loader.start()
+
+    # Loader thread: read requested chunks and build their edge vertices, no OpenGL here
+    def load_chunks(self):
+        while True:
+            coord = self.requests.get()
+            if coord is None:
+                return
+            if coord not in self.wanted:
+                self.results.put((coord, None, None))  # Left behind before its turn came
+                continue
+            try:
+                boxes = np.asarray(self.source.load(coord), dtype=np.float32).reshape(-1, 2, 3)
+            except (OSError, ValueError) as e:
+                log.warning("Could not load chunk %s: %s", coord, e)
+                self.results.put((coord, None, None))
+                continue
+            self.results.put((coord, boxes, box_edge_vertices(boxes)))
+
+    # Existing chunks within load_radius chunks (in every axis) of a world position
+    def chunks_around(self, position):
+        center = np.floor(np.asarray(position, dtype=np.float64) / self.chunk_size).astype(int).tolist()
+        steps = range(-self.load_radius, self.load_radius + 1)
+        return [coord for coord in ((center[0] + i, center[1] + j, center[2] + k)
+                                    for i in steps for j in steps for k in steps)
+                if self.source.has_chunk(coord)]
+
+    def update(self, position):
+        wanted = self.chunks_around(position)
+        self.wanted = frozenset(wanted)
+        for coord in wanted:
+            if coord in self.resident:
+                self.resident.move_to_end(coord)
+            elif coord not in self.pending:
+                self.pending.add(coord)
+                self.requests.put(coord)
+
+        for _ in range(self.uploads_per_frame):
+            try:
+                coord, boxes, vertices = self.results.get_nowait()
+            except queue.Empty:
+                break
+            self.pending.discard(coord)
+            if boxes is not None and coord not in self.resident:
+                self.resident[coord] = self.upload(coord, boxes, vertices)
+                log.count('chunks loaded')
+
+        # Evict the least recently wanted chunks, but never one in range
+        while len(self.resident) > self.capacity:
+            coord = next(iter(self.resident))
+            if coord in self.wanted:
+                break
+            self.evict(coord)
+
+    def upload(self, coord, boxes, vertices):
+        for i, (box_min, box_max) in enumerate(boxes.tolist()):
+            self.obstacles.insert((coord, i), box_min, box_max)
+        vao = glGenVertexArrays(1)
+        glBindVertexArray(vao)
+        vbo = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, vbo)
+        glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL_STATIC_DRAW)
+        glEnableVertexAttribArray(0)  # Attribute 0 aliases the fixed-function vertex position
+        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 3 * 4, ctypes.c_void_p(0))
+        glBindVertexArray(0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        if len(boxes):
+            return vao, vbo, len(vertices), boxes[:, 0].min(axis=0), boxes[:, 1].max(axis=0)
+        return vao, vbo, 0, np.zeros(3), np.zeros(3)
+
+    def evict(self, coord):
+        vao, vbo, vertex_count = self.resident.pop(coord)[:3]
+        for i in range(vertex_count // len(box_edge_corners)):
+            self.obstacles.remove((coord, i))
+        glDeleteVertexArrays(1, [vao])
+        glDeleteBuffers(1, [vbo])
+        log.count('chunks evicted')
+
+    # Resident obstacle boxes overlapping the given box, as an (n, 2, 3) array
+    def touching(self, box_min, box_max):
+        keys = self.obstacles.query(box_min, box_max)
+        return np.array([self.obstacles.boxes[key] for key in keys]).reshape(-1, 2, 3)
+
+    # Drop every chunk (the loader thread keeps running)
+    def clear(self):
+        for coord in list(self.resident):
+            self.evict(coord)
+
+    # Draw the obstacle outlines of the resident chunks, or only of those a FrustumCuller sees
+    def draw(self, culler=None):
+        chunks = [chunk for chunk in self.resident.values() if chunk[2]]
+        if not chunks:
+            return
+        if culler is not None:
+            visible = culler.visible('world', np.array([chunk[3] for chunk in chunks]),
+                                     np.array([chunk[4] for chunk in chunks]))
+            chunks = [chunk for chunk, shown in zip(chunks, visible.tolist()) if shown]
+        glLineWidth(self.line_width)
+        if self.program is not None:
+            glUseProgram(self.program)
+            glUniform4f(self.color_location, *self.color, 1.0)
+        else:
+            glColor3f(*self.color)
+        for vao, _, vertex_count, _, _ in chunks:
+            glBindVertexArray(vao)
+            glDrawArrays(GL_LINES, 0, vertex_count)
+        glBindVertexArray(0)
+        if self.program is not None:
+            glUseProgram(0)
+
+    # Stop the loader thread
+    def close(self):
+        self.requests.put(None)
+        self.loader.join()
+
+# Full-screen triangle strip with its corners made from the vertex index
+fullscreen_quad_vertex_shader = """#version 330 core
+void main() {
+    vec2 corner = vec2(gl_VertexID % 2, gl_VertexID / 2) * 2.0 - 1.0;
+    gl_Position = vec4(corner, 0.0, 1.0);
+}
+"""
+
+fullscreen_quad = None  # (program, color location, empty VAO), or False without shaders
+
+# Composite one full-screen quad of the given color over the frame
+def draw_fullscreen_quad(red, green, blue, alpha):
+    global fullscreen_quad
+    depth_test = glIsEnabled(GL_DEPTH_TEST)
+    glDisable(GL_DEPTH_TEST)
+    glEnable(GL_BLEND)
+    glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+
+    if fullscreen_quad is None:
+        try:
+            program = shader_cache.get(fullscreen_quad_vertex_shader, color_fragment_shader, [])
+            fullscreen_quad = (program, glGetUniformLocation(program, 'color'), glGenVertexArrays(1))
+        except (OpenGL.error.GLError, OpenGL.error.NullFunctionError, RuntimeError) as e:
+            log.warning("Full-screen quad shader unavailable, using immediate mode: %s", e)
+            fullscreen_quad = False
+    if fullscreen_quad:
+        program, color_location, vao = fullscreen_quad
+        glUseProgram(program)
+        glUniform4f(color_location, red, green, blue, alpha)
+        glBindVertexArray(vao)
+        glDrawArrays(GL_TRIANGLE_STRIP, 0, 4)
+        glBindVertexArray(0)
+        glUseProgram(0)
+        glDisable(GL_BLEND)
+        if depth_test:
+            glEnable(GL_DEPTH_TEST)
+        return
+
+    # Orthographic projection that covers the whole screen
+    glMatrixMode(GL_PROJECTION)
+    glPushMatrix()
+    glLoadIdentity()
+    glOrtho(-1, 1, -1, 1, -1, 1)
+    glMatrixMode(GL_MODELVIEW)
+    glPushMatrix()
+    glLoadIdentity()
+
+    glColor4f(red, green, blue, alpha)
+    glBegin(GL_QUADS)
+    glVertex2f(-1, -1)
+    glVertex2f(1, -1)
+    glVertex2f(1, 1)
+    glVertex2f(-1, 1)
+    glEnd()
+
+    glPopMatrix()
+    glMatrixMode(GL_PROJECTION)
+    glPopMatrix()
+    glMatrixMode(GL_MODELVIEW)
+    glDisable(GL_BLEND)
+    if depth_test:
+        glEnable(GL_DEPTH_TEST)
+
+# Fade to a color and back, driven by the game's own time steps
+#
+# start() fades the screen out; once it is fully covered on_peak runs (e.g. to
+# reset the level behind the flash), the color holds for a moment and then
+# fades back in, all within duration seconds. Nothing blocks: update() is
+# called from the simulation and render() composites the current fade over
+# the frame.
+class ScreenTransition:
+    def __init__(self):
+        self.state = 'idle'  # 'idle', 'fade_out', 'hold' or 'fade_in'
+        self.time = 0.0  # Time spent in the current state
+        self.fade_time = 0.5
+        self.hold_time = 0.0
+        self.color = (1.0, 1.0, 1.0)
+        self.on_peak = None
+
+    @property
+    def active(self):
+        return self.state != 'idle'
+
+    def start(self, duration=1.0, hold=0.1, color=(1.0, 1.0, 1.0), on_peak=None):
+        self.state = 'fade_out'
+        self.time = 0.0
+        self.hold_time = min(hold, duration)
+        self.fade_time = max((duration - self.hold_time) / 2, 1e-3)  # The rest is half fade out, half fade in
+        self.color = color
+        self.on_peak = on_peak
+
+    def update(self, delta_time):
+        if self.state == 'idle':
+            return
+        self.time += delta_time
+        if self.state == 'fade_out' and self.time >= self.fade_time:
+            self.state, self.time = 'hold', self.time - self.fade_time
+            if self.on_peak is not None:
+                self.on_peak()
+        if self.state == 'hold' and self.time >= self.hold_time:
+            self.state, self.time = 'fade_in', self.time - self.hold_time
+        if self.state == 'fade_in' and self.time >= self.fade_time:
+            self.state, self.time = 'idle', 0.0
+
+    # How much of the screen the color covers right now (0 to 1)
+    def alpha(self):
+        if self.state == 'fade_out':
+            return min(self.time / self.fade_time, 1.0)
+        if self.state == 'hold':
+            return 1.0
+        if self.state == 'fade_in':
+            return max(1.0 - self.time / self.fade_time, 0.0)
+        return 0.0
+
+    def render(self):
+        if self.state != 'idle':
+            draw_fullscreen_quad(*self.color, self.alpha())
+
+# Read the current OpenGL frame back into a pygame surface
+def read_frame():
+    width, height = offscreen_size if offscreen_framebuffer else pygame.display.get_surface().get_size()
+    glPixelStorei(GL_PACK_ALIGNMENT, 1)
+    pixels = glReadPixels(0, 0, width, height, GL_RGB, GL_UNSIGNED_BYTE)
+    frame = pygame.image.frombuffer(pixels, (width, height), 'RGB')
+    return pygame.transform.flip(frame, False, True)  # OpenGL rows start at the bottom
+
+# Record the statistics of the frame that just finished
+def record_bench_frame():
+    global bench_last_flip, bench_last_blocks, gl_call_count, gc_collection_count
+    now = time.perf_counter()
+    blocks = sys.getallocatedblocks()
+    if bench_last_flip is not None and frame_number > options.bench_warmup:
+        bench_frame_times.append((now - bench_last_flip) * 1000.0)
+        bench_gl_calls.append(gl_call_count)
+        bench_gc_collections.append(gc_collection_count)
+        # Blocks allocated minus blocks freed: frees hide allocations that don't outlive the frame
+        bench_net_allocated_blocks.append(blocks - bench_last_blocks)
+        if options.bench_trace_alloc:
+            current, peak = tracemalloc.get_traced_memory()
+            bench_allocated_bytes.append(peak - current)
+    if options.bench_trace_alloc:
+        tracemalloc.reset_peak()
+    gl_call_count = 0
+    gc_collection_count = 0
+    bench_last_blocks = blocks
+    bench_last_flip = time.perf_counter()  # Don't count the bookkeeping above
+
+# Write the collected per-frame statistics for benchmark.py
+def write_bench_json():
+    results = {
+        'renderer': glGetString(GL_RENDERER).decode() if offscreen_framebuffer else None,
+        'warmup_frames': options.bench_warmup,
+        'frame_ms': bench_frame_times,
+        'gl_calls': bench_gl_calls,
+        'gc_collections': bench_gc_collections,
+        'net_allocated_blocks': bench_net_allocated_blocks,
+        'allocated_bytes': bench_allocated_bytes if options.bench_trace_alloc else None,
+    }
+    with open(options.bench_json, 'w') as bench_file:
+        json.dump(results, bench_file)
+
+# Present the frame: swap buffers on screen, finish the offscreen frame when headless
+def flip():
+    global frame_number
+    frame_number += 1
+
+    if offscreen_framebuffer is not None:
+        glFinish()
+        if options.capture and frame_number % max(options.capture_every, 1) == 0:
+            os.makedirs(options.capture, exist_ok=True)
+            pygame.image.save(read_frame(), os.path.join(options.capture, f"frame_{frame_number:06d}.png"))
+    else:
+        pygame.display.flip()
+
+    log.end_frame()
+
+    if benchmarking:
+        record_bench_frame()
+
+    if headless and options.frames and frame_number >= options.frames:
+        if benchmarking:
+            write_bench_json()
+        print(f"[INFO] Headless mode: {frame_number} frames done.")
+        pygame.quit()
+        sys.exit(0)
@@ -0,0 +1,190 @@
+# Cube Libre level format
+#
+# The obstacles, lasers and portals of a level on disk: the binary level file
+# (LevelFile, written by convert_level.py) and the older directory of one .npy
+# file per chunk (ChunkDirectory). Both are sources for cube_common.ChunkedWorld.
+# This module only needs NumPy, so tools that write levels don't pull in
+# pygame and OpenGL.
+#
+# https://github.com/FlyingFathead/pygame-opengl-polygon-demos
+
+import json
+import os
+
+import numpy as np
+
+# Cut the boxes (an (n, 2, 3) array of min and max corners) that are longer than
+# max_size along an axis into equal pieces no longer than that. Levels file every
+# obstacle under the chunk holding its center, so this keeps each obstacle within
+# half a chunk of its own: loaded whenever something near it is.
+def split_boxes(boxes, max_size):
+    for axis in range(3):
+        lengths = boxes[:, 1, axis] - boxes[:, 0, axis]
+        pieces = np.maximum(np.ceil(lengths / max_size - 1e-6), 1).astype(int)
+        piece_length = np.repeat(lengths / pieces, pieces)
+        piece = np.arange(pieces.sum()) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+        boxes = np.repeat(boxes, pieces, axis=0)
+        boxes[:, 0, axis] += piece * piece_length
+        boxes[:, 1, axis] = boxes[:, 0, axis] + piece_length
+    return boxes
+
+# A level stored as one .npy file of obstacle boxes per chunk, next to a
+# world.json index of the chunk size and the chunks that exist.
+# Obstacles are (n, 2, 3) float32 arrays of min and max corners, filed under
+# the chunk that holds their center. Chunks are cubes of chunk_size world units;
+# chunk (i, j, k) covers [i, i + 1) * chunk_size in x, and likewise in y and z.
+class ChunkDirectory:
+    chunk_file_name = 'chunk_{}_{}_{}.npy'
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'world.json')) as index_file:
+            index = json.load(index_file)
+        self.chunk_size = float(index['chunk_size'])
+        self.coords = {tuple(coord) for coord in index['chunks']}
+
+    def has_chunk(self, coord):
+        return coord in self.coords
+
+    # Obstacle boxes of one chunk (called from the loader thread)
+    def load(self, coord):
+        return np.load(os.path.join(self.path, self.chunk_file_name.format(*coord)))
+
+    # Split a whole level's obstacle boxes into chunk files under path
+    @staticmethod
+    def write(path, obstacles, chunk_size):
+        obstacles = split_boxes(np.asarray(obstacles, dtype=np.float32).reshape(-1, 2, 3), chunk_size)
+        os.makedirs(path, exist_ok=True)
+        chunk_of = np.floor(obstacles.mean(axis=1) / chunk_size).astype(int)
+        coords, chunk_index = np.unique(chunk_of, axis=0, return_inverse=True)
+        for i, coord in enumerate(coords.tolist()):
+            np.save(os.path.join(path, ChunkDirectory.chunk_file_name.format(*coord)),
+                    obstacles[chunk_index.ravel() == i])
+        with open(os.path.join(path, 'world.json'), 'w') as index_file:
+            json.dump({'chunk_size': chunk_size, 'chunks': coords.tolist()}, index_file)
+
+# Binary level file (see convert_level.py for writing one from JSON or TOML).
+#
+# Layout, little-endian, every section starting on a 16-byte boundary:
+#   header       level_header_dtype: magic, format version, chunk size, start
+#                position, horizon height, horizon grid size, section sizes
+#                and byte offsets
+#   chunk index  level_index_dtype per chunk that holds obstacles, sorted by
+#                key (chunk_key): first and count of its obstacles
+#   obstacles    float32 (n, 2, 3) min and max corners, grouped by chunk
+#   lasers       level_laser_dtype
+#   portals      level_portal_dtype
+# Obstacles belong to the chunk holding their center; obstacles longer than a
+# chunk are stored cut into pieces (split_boxes). Lasers and portals are few
+# and always loaded whole.
+level_magic = b'CUBELEVL'
+level_version = 2
+level_header_dtype = np.dtype([
+    ('magic', 'S8'), ('version', '<u4'), ('chunk_size', '<f4'),
+    ('start_position', '<f4', 3), ('horizon_y', '<f4'), ('grid_extent', '<f4'), ('grid_step', '<f4'),
+    ('chunk_count', '<u4'), ('obstacle_count', '<u4'), ('laser_count', '<u4'), ('portal_count', '<u4'),
+    ('index_offset', '<u8'), ('obstacles_offset', '<u8'), ('lasers_offset', '<u8'), ('portals_offset', '<u8'),
+])
+level_index_dtype = np.dtype([('key', '<i8'), ('coord', '<i4', 3),
+                              ('obstacle_first', '<u4'), ('obstacle_count', '<u4')])
+
+# A beam from start to end, swept back and forth by `sweep` over `period` seconds
+level_laser_dtype = np.dtype([('start', '<f4', 3), ('end', '<f4', 3), ('sweep', '<f4', 3), ('period', '<f4')])
+level_portal_dtype = np.dtype([('position', '<f4', 3), ('size', '<f4')])
+
+# Chunk coordinates packed into one sortable int64 (21 bits per axis)
+def chunk_key(coords):
+    coords = np.asarray(coords, dtype=np.int64) + (1 << 20)
+    return (coords[..., 0] << 42) | (coords[..., 1] << 21) | coords[..., 2]
+
+# A level file opened through numpy.memmap: opening only reads the header, and
+# the pages of a chunk's obstacles are read from disk the first time the chunk
+# is loaded, so levels of any size open in constant time. Also a ChunkedWorld
+# source.
+class LevelFile:
+    def __init__(self, path):
+        self.path = path
+        header = np.fromfile(path, dtype=level_header_dtype, count=1)
+        if len(header) == 0 or header['magic'][0] != level_magic:
+            raise ValueError(f"{path} is not a Cube Libre level file")
+        header = header[0]
+        if header['version'] != level_version:
+            raise ValueError(f"{path} has level format version {header['version']}, expected {level_version}")
+
+        self.chunk_size = float(header['chunk_size'])
+        self.start_position = tuple(header['start_position'].tolist())
+        self.horizon_y = float(header['horizon_y'])
+        self.grid_extent = float(header['grid_extent'])
+        self.grid_step = float(header['grid_step'])
+        self.index = self.section(header['index_offset'], level_index_dtype, (int(header['chunk_count']),))
+        self.obstacles = self.section(header['obstacles_offset'], np.dtype('<f4'), (int(header['obstacle_count']), 2, 3))
+        self.lasers = self.section(header['lasers_offset'], level_laser_dtype, (int(header['laser_count']),))
+        self.portals = self.section(header['portals_offset'], level_portal_dtype, (int(header['portal_count']),))
+
+    def section(self, offset, dtype, shape):
+        if 0 in shape:
+            return np.zeros(shape, dtype=dtype)  # numpy.memmap cannot map an empty array
+        return np.memmap(self.path, dtype=dtype, mode='r', offset=int(offset), shape=shape)
+
+    # Index entry of a chunk (binary search of the sorted keys), or None for
+    # a chunk without obstacles
+    def chunk_entry(self, coord):
+        key = chunk_key(coord)
+        row = int(np.searchsorted(self.index['key'], key))
+        if row == len(self.index) or self.index['key'][row] != key:
+            return None
+        return self.index[row]
+
+    def has_chunk(self, coord):
+        return self.chunk_entry(coord) is not None
+
+    # Obstacle boxes of one chunk (a view into the mapped file)
+    def load(self, coord):
+        entry = self.chunk_entry(coord)
+        first = int(entry['obstacle_first'])
+        return self.obstacles[first:first + int(entry['obstacle_count'])]
+
+    @staticmethod
+    def write(path, obstacles=(), lasers=None, portals=None, chunk_size=10.0, start_position=(0.0, 0.0, 0.0),
+              horizon_y=-5.0, grid_extent=20.0, grid_step=2.0):
+        obstacles = split_boxes(np.asarray(obstacles, dtype='<f4').reshape(-1, 2, 3), chunk_size)
+        lasers = np.asarray(lasers if lasers is not None else [], dtype=level_laser_dtype).reshape(-1)
+        portals = np.asarray(portals if portals is not None else [], dtype=level_portal_dtype).reshape(-1)
+
+        # Group the obstacles by chunk and record every chunk's range of them
+        obstacle_chunks = np.floor(obstacles.mean(axis=1) / chunk_size).astype(np.int64)
+        keys = chunk_key(obstacle_chunks)
+        order = np.argsort(keys, kind='stable')
+        obstacles = obstacles[order]
+        chunk_keys, firsts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+        index = np.zeros(len(chunk_keys), dtype=level_index_dtype)
+        index['key'] = chunk_keys
+        index['coord'] = obstacle_chunks[order][firsts]
+        index['obstacle_first'] = firsts
+        index['obstacle_count'] = counts
+
+        header = np.zeros((), dtype=level_header_dtype)
+        offset = 0
+        sections = []
+        for name, data in (('header', header), ('index', index), ('obstacles', obstacles), ('lasers', lasers),
+                           ('portals', portals)):
+            if name != 'header':
+                header[name + '_offset'] = offset
+            sections.append((offset, data))
+            offset = (offset + data.nbytes + 15) // 16 * 16
+        header['magic'] = level_magic
+        header['version'] = level_version
+        header['chunk_size'] = chunk_size
+        header['start_position'] = start_position
+        header['horizon_y'] = horizon_y
+        header['grid_extent'] = grid_extent
+        header['grid_step'] = grid_step
+        header['chunk_count'] = len(index)
+        header['obstacle_count'] = len(obstacles)
+        header['laser_count'] = len(lasers)
+        header['portal_count'] = len(portals)
+
+        with open(path, 'wb') as level_file:
+            for offset, data in sections:
+                level_file.seek(offset)
+                level_file.write(np.ascontiguousarray(data).tobytes())
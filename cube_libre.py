@@ -8,9 +8,13 @@
 # By FlyingFathead (w/ a little help from imaginary digital friends) // Dec 2023 - Dec 2024
 # https://github.com/FlyingFathead/pygame-opengl-polygon-demos
 
-version_number = "0.12.61"
+version_number = "0.13.21"
 
 import os
+import time
+import ctypes
+import cube_common  # Must come before pygame / OpenGL (sets up --headless)
+import cube_level
 import pygame
 
 from pygame.locals import DOUBLEBUF, OPENGL
@@ -18,7 +22,7 @@ from OpenGL.GL import *
 from OpenGL.GLUT import *
 from OpenGL.GLU import *
 
-# import numpy as np # should you need numpy
+import numpy as np
 import random
 
 # Detect if running under Wayland
@@ -37,6 +41,10 @@ else:
 cube_size = 5  # Number of small cubes per side
 cube_spacing = 1.0  # Increased spacing to avoid overlap
 cube_break_velocity_factor = 0.3  # Adjust this to make cubes fly off faster or slower
+debris_spin_speed = 180.0  # Fastest spin of a flying-off cube, in degrees per second
+debris_lifetime = 4.0  # Seconds before a flying-off cube is retired
+laser_color = (1.0, 0.1, 0.1)
+laser_width = 2
 
 # Calculate the step size for positioning small cubes
 step = cube_spacing
@@ -57,6 +65,34 @@ portal_size = 5.0  # Width and height of the portal
 portal_color = (0.0, 1.0, 1.0)  # Cyan color for glowing effect
 portal_glow_steps = 10  # Number of overlapping quads for the glow effect
 portal_glow_alpha = 0.3  # Initial alpha for the glow
+portal_positions = [portal_position]
+portal_sizes = [portal_size]
+
+# Laser beams across the way to the portal: start, end, and how far and in how many
+# seconds each one sweeps back and forth (see cube_level.level_laser_dtype)
+lasers = np.array([((-6.0, 0.0, -26.0), (-6.0, 0.0, -10.0), (0.0, 4.0, 0.0), 3.0),
+                   ((2.0, 0.0, -26.0), (2.0, 0.0, -10.0), (0.0, 4.0, 0.0), 2.0),
+                   ((10.0, -4.0, -26.0), (10.0, 4.0, -10.0), (4.0, 0.0, 0.0), 4.0)],
+                  dtype=cube_level.level_laser_dtype)
+
+# Set CUBE_LIBRE_LEVEL to a level file written by convert_level.py: its start,
+# portals, horizon and grid replace the hardcoded ones, and its obstacles are
+# streamed in around the body (a directory written by cube_level.ChunkDirectory.write
+# only adds obstacles)
+level_path = os.environ.get('CUBE_LIBRE_LEVEL')
+level = None
+if level_path and not os.path.isdir(level_path):
+    try:
+        level = cube_level.LevelFile(level_path)
+    except (OSError, ValueError) as e:
+        cube_common.log.warning("Could not open level %s: %s", level_path, e)
+        level_path = None
+if level is not None:
+    lasers = np.array(level.lasers)  # Every beam is tested every step, so read them all in
+if level is not None and len(level.portals):
+    portal_positions = [tuple(position) for position in level.portals['position'].tolist()]
+    portal_sizes = level.portals['size'].tolist()
+    portal_position = portal_positions[0]
 
 # # Request an OpenGL 3.3 core profile context
 # pygame.display.gl_set_attribute(pygame.GL_CONTEXT_MAJOR_VERSION, 3)
@@ -71,10 +107,16 @@ pygame.display.gl_set_attribute(pygame.GL_CONTEXT_MAJOR_VERSION, 3)
 pygame.display.gl_set_attribute(pygame.GL_CONTEXT_MINOR_VERSION, 3)
 pygame.display.gl_set_attribute(pygame.GL_CONTEXT_PROFILE_MASK, pygame.GL_CONTEXT_PROFILE_COMPATIBILITY)
 
+# Set CUBE_LIBRE_CORE_PROFILE=1 for a 3.3 core profile context instead: everything
+# is drawn by shaders then, and the fixed-function fallback paths are left out
+use_core_profile = os.environ.get('CUBE_LIBRE_CORE_PROFILE', '0') == '1'
+if use_core_profile:
+    pygame.display.gl_set_attribute(pygame.GL_CONTEXT_PROFILE_MASK, pygame.GL_CONTEXT_PROFILE_CORE)
+
 # pygame.display.set_mode(display, DOUBLEBUF | OPENGL)
 
 try:
-    pygame.display.set_mode(display, DOUBLEBUF | OPENGL)
+    cube_common.set_mode(display, DOUBLEBUF | OPENGL)
 except pygame.error as e:
     print(f"Pygame failed to set display mode with OpenGL: {e}")
     pygame.quit()
@@ -112,12 +154,12 @@ else:
 # Enable depth testing
 glEnable(GL_DEPTH_TEST)
 
-# Set perspective and translate
+# Perspective camera for every shader (cube_common.Camera); the view is set per frame in draw_scene
+camera_distance = 20.0  # Move the view farther back
 try:
-    gluPerspective(45, (display[0] / display[1]), 0.1, 50.0)
-    glTranslatef(0.0, 0.0, -20.0)  # Move the view farther back
+    camera = cube_common.Camera(45, (display[0] / display[1]), 0.1, 50.0, fixed_function=not use_core_profile)
 except OpenGL.error.GLError as e:
-    print(f"OpenGL Error during gluPerspective or glTranslatef: {e}")
+    print(f"OpenGL Error during camera setup: {e}")
     pygame.quit()
     quit()
 
@@ -190,6 +232,10 @@ try:
     glEnableVertexAttribArray(0)
     glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 0, None)
 
+    # The six faces as triangles
+    cube_index_count = 36
+    cube_index_buffer = cube_common.create_index_buffer(cube_common.quad_indices(6))
+
     # Unbind the VAO and VBO
     glBindVertexArray(0)
     glBindBuffer(GL_ARRAY_BUFFER, 0)
@@ -198,72 +244,936 @@ except OpenGL.error.GLError as e:
     pygame.quit()
     quit()
 
+# Shader that draws one small cube per instance, offset and colored per instance
+instanced_vertex_shader = cube_common.core_shader_header + """
+in vec3 position;
+in vec3 instance_offset;
+in vec4 instance_color;
+out vec4 color;
+void main() {
+    color = instance_color;
+    gl_Position = view_projection * vec4(position + instance_offset, 1.0);
+}
+"""
+
+instanced_fragment_shader = """
+#version 330 core
+in vec4 color;
+out vec4 frag_color;
+void main() {
+    frag_color = color;
+}
+"""
+
+# Shader for the face-culled mesh of the intact cubes, moved by the body offset;
+# the color is looked up in the gradient texture (see gradient_lut) at each cube's world y
+body_mesh_vertex_shader = cube_common.core_shader_header + """
+in vec3 position;
+in float cube_y;
+uniform vec3 body_offset;
+uniform float body_y;
+uniform sampler1D gradient;
+uniform vec2 gradient_transform;
+out vec4 color;
+void main() {
+    color = vec4(texture(gradient, (body_y + cube_y) * gradient_transform.x + gradient_transform.y).rgb, 1.0);
+    gl_Position = view_projection * vec4(position + body_offset, 1.0);
+}
+"""
+
+# Shader for the debris of destroyed cubes: each instance spins about its own
+# axis (Rodrigues' rotation) before it is moved to its position
+debris_vertex_shader = cube_common.core_shader_header + """
+in vec3 position;
+in vec3 instance_offset;
+in vec4 instance_rotation;  // Unit axis and angle in radians
+in vec4 instance_color;
+out vec4 color;
+void main() {
+    vec3 axis = instance_rotation.xyz;
+    float c = cos(instance_rotation.w);
+    float s = sin(instance_rotation.w);
+    vec3 rotated = position * c + cross(axis, position) * s + axis * dot(axis, position) * (1.0 - c);
+    color = instance_color;
+    gl_Position = view_projection * vec4(rotated + instance_offset, 1.0);
+}
+"""
+
+# Transform feedback pass that advances the GPU debris state by one simulation
+# step (same integration as DebrisSystem.update); nothing is rasterized
+gpu_debris_update_shader = """
+#version 330 core
+in vec4 position_age;
+in vec4 velocity_spin;
+in vec4 axis_angle;
+uniform float delta_time;
+uniform float flash_duration;
+out vec4 next_position_age;
+out vec4 next_velocity_spin;
+out vec4 next_axis_angle;
+void main() {
+    float age = position_age.w + delta_time;
+    float moving_time = clamp(age - flash_duration, 0.0, delta_time);
+    next_position_age = vec4(position_age.xyz + velocity_spin.xyz * moving_time, age);
+    next_velocity_spin = velocity_spin;
+    next_axis_angle = vec4(axis_angle.xyz, axis_angle.w + velocity_spin.w * moving_time);
+}
+"""
+
+# Draws the GPU debris straight from its state buffer; the previous step is
+# recovered from the velocity for render interpolation, the fade from the age
+gpu_debris_vertex_shader = cube_common.core_shader_header + """
+in vec3 position;
+in vec4 position_age;
+in vec4 velocity_spin;
+in vec4 axis_angle;
+uniform float alpha;
+uniform float delta_time;
+uniform float flash_duration;
+uniform float lifetime;
+uniform float fade_time;
+uniform float step;
+out vec4 color;
+void main() {
+    float back = (1.0 - alpha) * clamp(position_age.w - flash_duration, 0.0, delta_time);
+    vec3 center = (position_age.xyz - velocity_spin.xyz * back) * step;
+    float angle = radians(axis_angle.w - velocity_spin.w * back);
+    vec3 axis = axis_angle.xyz;
+    float c = cos(angle);
+    float s = sin(angle);
+    vec3 rotated = position * c + cross(axis, position) * s + axis * dot(axis, position) * (1.0 - c);
+    color = vec4(1.0, 1.0, 1.0, min((lifetime - position_age.w) / fade_time, 1.0));
+    gl_Position = view_projection * vec4(rotated + center, 1.0);
+}
+"""
+
+# Draw all small cubes with a single instanced call (toggle with the I key);
+# set CUBE_LIBRE_INSTANCED=0 to start with the old one-draw-per-cube path
+use_instanced_rendering = os.environ.get('CUBE_LIBRE_INSTANCED', '1') != '0'
+
+# Per-instance data: x, y, z offset followed by an RGBA color
+instance_floats = 7
+instance_program = None
+
+# Attach a second VBO with the per-instance attributes to the cube VAO
+try:
+    instance_vbo = glGenBuffers(1)
+    glBindVertexArray(vao)
+    glBindBuffer(GL_ARRAY_BUFFER, instance_vbo)
+
+    glEnableVertexAttribArray(1)
+    glVertexAttribPointer(1, 3, GL_FLOAT, GL_FALSE, instance_floats * 4, ctypes.c_void_p(0))
+    glVertexAttribDivisor(1, 1)
+
+    glEnableVertexAttribArray(2)
+    glVertexAttribPointer(2, 4, GL_FLOAT, GL_FALSE, instance_floats * 4, ctypes.c_void_p(3 * 4))
+    glVertexAttribDivisor(2, 1)
+
+    glBindVertexArray(0)
+    glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    instance_program = cube_common.shader_cache.get(instanced_vertex_shader, instanced_fragment_shader,
+                                                    ['position', 'instance_offset', 'instance_color'])
+except (OpenGL.error.GLError, OpenGL.error.NullFunctionError, RuntimeError) as e:
+    cube_common.log.warning("Instanced rendering unavailable, drawing one cube at a time: %s", e)
+    use_instanced_rendering = False
+
+# The per-cube path needs the fixed-function pipeline, which the core profile does not have
+if use_core_profile and not use_instanced_rendering and instance_program is not None:
+    cube_common.log.warning("CUBE_LIBRE_INSTANCED=0 is not available in the core profile, drawing the cubes instanced")
+    use_instanced_rendering = True
+
 # Initialize rotation angles
 angle_x, angle_y, angle_z = 0.0, 0.0, 0.0
-rotation_speed = 1.0  # Adjust rotation speed as needed
+previous_angle_x, previous_angle_y, previous_angle_z = angle_x, angle_y, angle_z
+rotation_speed = 1.0  # Degrees per simulation step
+
+# Gradient over the height of the cube body, precomputed into a lookup table;
+# pick a palette from cube_common.gradient_palettes with CUBE_LIBRE_PALETTE (G cycles them)
+gradient_palette = os.environ.get('CUBE_LIBRE_PALETTE', 'classic')
+if gradient_palette not in cube_common.gradient_palettes:
+    cube_common.log.warning("Unknown palette '%s', using 'classic'", gradient_palette)
+    gradient_palette = 'classic'
+gradient_lut = cube_common.GradientLUT(cube_common.gradient_palettes[gradient_palette],
+                                       -cube_size / 2, cube_size / 2)
+
+# Switch every cube render path to the next palette
+def cycle_gradient_palette():
+    global gradient_palette
+    names = list(cube_common.gradient_palettes)
+    gradient_palette = names[(names.index(gradient_palette) + 1) % len(names)]
+    gradient_lut.set_stops(cube_common.gradient_palettes[gradient_palette])
+    print(f"[INFO] Gradient palette: {gradient_palette}")
 
 # Define a function to generate random RGB colors
 def random_color():
     return [random.uniform(0, 1), random.uniform(0, 1), random.uniform(0, 1)]
 
-class Cube:
-    def __init__(self, x, y, z):
-        self.x = x
-        self.y = y
-        self.z = z
-        self.color = self.random_color()  # Assign a random color at creation
-        self.is_destroyed = False
+# Struct-of-arrays store for all the small cubes of the main cube
+class CubeField:
+    def __init__(self, size, origin):
+        self.size = size
+        self.start_position = np.asarray(origin, dtype=np.float64)
         self.flash_duration = 0.2  # Duration of flash effect in seconds
-        self.time_since_destroyed = 0  # Time since the cube was destroyed
-        self.rotation = 0.0  # Initialize rotation angle
-
-    @staticmethod
-    def random_color():
-        return [random.uniform(0, 1) for _ in range(3)]
 
-    # Add other necessary methods and attributes
+        # Grid coordinates in the same x/y/z nesting order as the old cubes[x][y][z] lists
+        coords = np.arange(-size // 2, size // 2)
+        grid_x, grid_y, grid_z = np.meshgrid(coords, coords, coords, indexing='ij')
+        self.grid_coords = np.stack([grid_x.ravel(), grid_y.ravel(), grid_z.ravel()], axis=1).astype(np.float64)
+        self.count = len(self.grid_coords)
+
+        # Shared body transform: a cube's world position is origin + its local offset,
+        # so moving the whole main cube only touches the origin
+        self.origin = self.start_position.copy()
+        self.offsets = self.grid_coords.copy()
+
+        # Body state at the previous simulation step, for render interpolation
+        self.previous_origin = self.origin.copy()
+        self.previous_offsets = self.offsets.copy()
+
+        # Per-cube state, one row per cube
+        # (velocity and angular velocity are what a cube flies off with, see DebrisSystem)
+        self.velocities = np.zeros((self.count, 3))
+        self.angular_velocity = np.zeros(self.count)
+        self.is_destroyed = np.zeros(self.count, dtype=bool)
+        self.colors = np.random.uniform(0, 1, (self.count, 3))
+
+        # Cube indices of every layer (grid y), intact ones packed at the front:
+        # layer_members[j, :layer_live_count[j]] are the intact cubes of layer j
+        # and member_slot[i] is where cube i sits, so destroy and reset are O(1)
+        self.layer_of = np.arange(self.count) // size % size
+        self.layer_members = np.arange(self.count).reshape(size, size, size).transpose(1, 0, 2).reshape(size, -1).copy()
+        self.member_slot = np.empty(self.count, dtype=np.intp)
+        self.member_slot[self.layer_members] = np.arange(size * size)
+        self.layer_live_count = np.full(size, size * size)
+        self.live_count = self.count  # Intact cubes in the whole body
+
+        # Called with the cube index whenever a cube gets destroyed
+        self.destroy_callbacks = []
+
+    # Swap cube i into the given slot of its layer's member list
+    def move_member(self, i, slot):
+        layer = self.layer_of[i]
+        other = self.layer_members[layer, slot]
+        old_slot = self.member_slot[i]
+        self.layer_members[layer, slot], self.layer_members[layer, old_slot] = i, other
+        self.member_slot[i], self.member_slot[other] = slot, old_slot
+
+    # A random intact cube of the layer (None if the layer is gone), in O(1)
+    def random_live_cube(self, layer):
+        live = self.layer_live_count[layer]
+        if live == 0:
+            return None
+        return int(self.layer_members[layer, random.randrange(live)])
+
+    # World y of the lowest intact cube of every layer (inf for empty layers)
+    def layer_min_y(self):
+        y = np.where(self.is_destroyed, np.inf, self.offsets[:, 1]).reshape(self.size, self.size, self.size)
+        return y.min(axis=(0, 2)) + self.origin[1]
 
     # upon destruction
-    def destroy(self):
-        print("Destroying cube")  # Debugging statement        
+    def destroy(self, i):
+        if self.is_destroyed[i]:
+            return  # Already flying off
+        layer = self.layer_of[i]
+        self.layer_live_count[layer] -= 1
+        self.live_count -= 1
+        self.move_member(i, self.layer_live_count[layer])
+        cube_common.log.count('cubes destroyed')
+        cube_common.log.debug("Destroying cube %d", i)
         # Change color to white/grey for the flash effect
-        self.color = [0.8, 0.8, 0.8]
-        # Set velocity for flying off
-        # self.velocity = [random.uniform(-1, 1), random.uniform(1, 2), random.uniform(-1, 1)]        
-        # Set lower velocity for flying off
-        
-        # old method
-        # self.velocity = [random.uniform(-0.5, 0.5), random.uniform(0.5, 1), random.uniform(-0.5, 0.5)]
-
+        self.colors[i] = 0.8
         # Use the velocity factor here
-        self.velocity = [
+        self.velocities[i] = (
             random.uniform(-0.5, 0.5) * cube_break_velocity_factor,
             random.uniform(0.5, 1) * cube_break_velocity_factor,
             random.uniform(-0.5, 0.5) * cube_break_velocity_factor
-        ]
-
+        )
         # Add angular velocity for swirling effect
-        self.angular_velocity = random.uniform(-3, 3) # Degrees per second
-        self.is_destroyed = True
-        self.time_since_destroyed = 0  # Reset timer on destruction        
+        self.angular_velocity[i] = random.uniform(-debris_spin_speed, debris_spin_speed)  # Degrees per second
+        self.is_destroyed[i] = True
+        for callback in self.destroy_callbacks:
+            callback(i)
+
+    # Put the whole body back together in place: every cube returns to its rest
+    # layout (grid_coords) and all state is cleared in bulk, no objects created
+    def reset(self):
+        self.origin[:] = self.start_position
+        np.copyto(self.offsets, self.grid_coords)
+        self.velocities.fill(0.0)
+        self.angular_velocity.fill(0.0)
+        self.is_destroyed.fill(False)
+        self.colors[:] = np.random.uniform(0, 1, (self.count, 3))
+        # With every cube intact, any member order is valid
+        self.layer_live_count.fill(self.size * self.size)
+        self.live_count = self.count
+        self.save_state()  # Don't interpolate from the old positions
+
+    @property
+    def destroyed_count(self):
+        return self.count - self.live_count
+
+    # World positions of every cube
+    @property
+    def positions(self):
+        return self.origin + self.offsets
+
+    # World positions blended between the previous and the current simulation step
+    def interpolated_positions(self, alpha):
+        origin = self.previous_origin + (self.origin - self.previous_origin) * alpha
+        offsets = self.previous_offsets + (self.offsets - self.previous_offsets) * alpha
+        return origin + offsets
+
+    # Remember the current state before a simulation step changes it
+    def save_state(self):
+        self.previous_origin[:] = self.origin
+        np.copyto(self.previous_offsets, self.offsets)
+
+    # Move the whole main cube by the same amount
+    def translate(self, delta_x, delta_y, delta_z):
+        self.origin += (delta_x, delta_y, delta_z)
+
+# Mesh of only the exposed faces of the intact cubes, in body-local coordinates.
+# Each visible face owns one slot in the VBO; destroying a cube frees the slots
+# of its faces and appends the neighbor faces it exposes, so only those few
+# faces are uploaded instead of rebuilding the whole mesh.
+class BodyMesh:
+    # Face order of the cube vertices: front, back, top, bottom, left, right
+    face_directions = np.array([(0, 0, 1), (0, 0, -1), (0, 1, 0), (0, -1, 0), (-1, 0, 0), (1, 0, 0)])
+    opposite_faces = np.array([1, 0, 3, 2, 5, 4])
+    face_template = np.array(vertices, dtype=np.float32).reshape(6, 4, 3)
+    vertex_floats = 4  # x, y, z and the cube's local y (for the gradient)
+
+    def __init__(self, field, program, gradient):
+        self.field = field
+        self.program = program
+        self.gradient = gradient
+        self.gradient_texture = gradient.create_texture()
+        self.body_offset_location = glGetUniformLocation(program, 'body_offset')
+        self.body_y_location = glGetUniformLocation(program, 'body_y')
+        glUseProgram(program)
+        glUniform1i(glGetUniformLocation(program, 'gradient'), 0)
+        glUniform2f(glGetUniformLocation(program, 'gradient_transform'), *gradient.texture_transform())
+        glUseProgram(0)
+
+        # Flat-index step to the neighbor behind each face
+        size = field.size
+        self.neighbor_steps = self.face_directions @ np.array([size * size, size, 1])
+
+        self.face_slots = np.full(field.count * 6, -1, dtype=np.int64)  # VBO slot of each face, -1 = hidden
+        self.slot_faces = np.empty(0, dtype=np.int64)  # Face in each VBO slot
+        self.face_count = 0
+
+        self.vbo = glGenBuffers(1)
+        self.vao = glGenVertexArrays(1)
+        glBindVertexArray(self.vao)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glEnableVertexAttribArray(0)
+        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, self.vertex_floats * 4, ctypes.c_void_p(0))
+        glEnableVertexAttribArray(1)
+        glVertexAttribPointer(1, 1, GL_FLOAT, GL_FALSE, self.vertex_floats * 4, ctypes.c_void_p(3 * 4))
+        self.index_buffer = cube_common.create_index_buffer(np.empty(0, dtype=np.uint32))
+        glBindVertexArray(0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+        field.destroy_callbacks.append(self.cube_destroyed)
+        self.rebuild()
+
+    # Vertex data of the given faces (face id = cube index * 6 + face)
+    def face_vertices(self, face_ids):
+        cube_indices = face_ids // 6
+        grid = self.field.grid_coords[cube_indices]
+        data = np.empty((len(face_ids), 4, self.vertex_floats), dtype=np.float32)
+        data[:, :, 0:3] = grid[:, None, :] * step + self.face_template[face_ids % 6]
+        data[:, :, 3] = grid[:, None, 1]
+        return data
+
+    # Visible faces of every intact cube, computed from scratch
+    def visible_faces(self):
+        size = self.field.size
+        intact = ~self.field.is_destroyed
+        occupied = np.zeros((size + 2, size + 2, size + 2), dtype=bool)
+        occupied[1:-1, 1:-1, 1:-1] = intact.reshape(size, size, size)
+        visible = np.empty((self.field.count, 6), dtype=bool)
+        for face, (dx, dy, dz) in enumerate(self.face_directions):
+            neighbor = occupied[1 + dx:size + 1 + dx, 1 + dy:size + 1 + dy, 1 + dz:size + 1 + dz]
+            visible[:, face] = intact & ~neighbor.ravel()
+        return np.flatnonzero(visible)
+
+    # Rebuild the whole mesh (at start and after a reset)
+    def rebuild(self):
+        face_ids = self.visible_faces()
+        self.face_count = len(face_ids)
+        self.slot_faces = np.empty(max(2 * self.face_count, 64), dtype=np.int64)  # Room to grow
+        self.slot_faces[:self.face_count] = face_ids
+        self.face_slots[:] = -1
+        self.face_slots[face_ids] = np.arange(self.face_count)
+
+        data = self.face_vertices(face_ids)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glBufferData(GL_ARRAY_BUFFER, len(self.slot_faces) * data[0].nbytes, None, GL_DYNAMIC_DRAW)
+        glBufferSubData(GL_ARRAY_BUFFER, 0, data.nbytes, data)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+        # Two triangles for every slot
+        indices = cube_common.quad_indices(len(self.slot_faces))
+        glBindVertexArray(self.vao)
+        glBufferData(GL_ELEMENT_ARRAY_BUFFER, indices.nbytes, indices, GL_STATIC_DRAW)
+        glBindVertexArray(0)
+
+    # Write the vertex data of one face into its slot
+    def upload_face(self, face_id, slot):
+        data = self.face_vertices(np.array([face_id]))
+        glBufferSubData(GL_ARRAY_BUFFER, slot * data.nbytes, data.nbytes, data)
+
+    def remove_face(self, face_id):
+        slot = self.face_slots[face_id]
+        last = self.face_count - 1
+        if slot != last:
+            # Move the last face into the freed slot
+            moved_face = self.slot_faces[last]
+            self.slot_faces[slot] = moved_face
+            self.face_slots[moved_face] = slot
+            self.upload_face(moved_face, slot)
+        self.face_slots[face_id] = -1
+        self.face_count -= 1
+
+    def add_face(self, face_id):
+        slot = self.face_count
+        self.slot_faces[slot] = face_id
+        self.face_slots[face_id] = slot
+        self.face_count += 1
+        self.upload_face(face_id, slot)
+
+    # Drop the faces of a destroyed cube and expose the neighbor faces behind it
+    def cube_destroyed(self, i):
+        size = self.field.size
+        grid_index = np.array(np.unravel_index(i, (size, size, size)))
+        exposed = []
+        for face, direction in enumerate(self.face_directions):
+            neighbor_index = grid_index + direction
+            if np.all((neighbor_index >= 0) & (neighbor_index < size)):
+                neighbor = i + self.neighbor_steps[face]
+                if not self.field.is_destroyed[neighbor]:
+                    exposed.append(neighbor * 6 + self.opposite_faces[face])
+
+        if self.face_count + len(exposed) > len(self.slot_faces):
+            self.rebuild()  # Out of room, start over with a bigger buffer
+            return
+
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        for face_id in range(i * 6, i * 6 + 6):
+            if self.face_slots[face_id] >= 0:
+                self.remove_face(face_id)
+        for face_id in exposed:
+            self.add_face(face_id)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    # Draw every visible face in one call; body_origin is the (interpolated) body origin
+    def draw(self, body_origin):
+        glUseProgram(self.program)
+        glUniform3f(self.body_offset_location, *(body_origin * step))
+        glUniform1f(self.body_y_location, body_origin[1])
+        glBindTexture(GL_TEXTURE_1D, self.gradient_texture)
+        glBindVertexArray(self.vao)
+        glDrawElements(GL_TRIANGLES, self.face_count * 6, GL_UNSIGNED_INT, None)
+        glBindVertexArray(0)
+        glBindTexture(GL_TEXTURE_1D, 0)
+        glUseProgram(0)
+
+# Destroyed cubes flying off as particles, integrated and drawn in batches.
+# A destroyed cube leaves the body: its world position and launch velocity are
+# copied into packed particle arrays (live particles at the front), update()
+# advances them all at once and draw() renders them as instanced cubes spinning
+# about random axes. Particles fade out over their last fade_time seconds and
+# are retired after lifetime seconds by compacting the arrays.
+class DebrisSystem:
+    instance_floats = 11  # x, y, z, rotation axis and angle, RGBA color
+
+    def __init__(self, field, program, lifetime=debris_lifetime, fade_time=1.0, capacity=256):
+        self.field = field
+        self.program = program
+        self.lifetime = lifetime
+        self.fade_time = fade_time
+        self.flash_duration = field.flash_duration  # Fragments hold still while they flash
+        self.count = 0
+        self.allocate(capacity)
+
+        if program is not None:
+            self.instance_vbo = glGenBuffers(1)
+            self.vao = glGenVertexArrays(1)
+            glBindVertexArray(self.vao)
+            glBindBuffer(GL_ARRAY_BUFFER, vbo)
+            glEnableVertexAttribArray(0)
+            glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 0, None)
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, cube_index_buffer)
+            glBindBuffer(GL_ARRAY_BUFFER, self.instance_vbo)
+            stride = self.instance_floats * 4
+            for location, (size, offset) in enumerate([(3, 0), (4, 3), (4, 7)], start=1):
+                glEnableVertexAttribArray(location)
+                glVertexAttribPointer(location, size, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(offset * 4))
+                glVertexAttribDivisor(location, 1)
+            glBindVertexArray(0)
+            glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+        field.destroy_callbacks.append(self.cube_destroyed)
+
+    # (Re)allocate the particle arrays, keeping the live particles
+    def allocate(self, capacity):
+        count = self.count
+        old = getattr(self, 'positions', None)
+        self.capacity = capacity
+        arrays = {
+            'positions': np.zeros((capacity, 3)),
+            'previous_positions': np.zeros((capacity, 3)),
+            'velocities': np.zeros((capacity, 3)),
+            'axes': np.zeros((capacity, 3)),
+            'angles': np.zeros(capacity),
+            'previous_angles': np.zeros(capacity),
+            'spins': np.zeros(capacity),
+            'ages': np.zeros(capacity),
+        }
+        for name, array in arrays.items():
+            if old is not None:
+                array[:count] = getattr(self, name)[:count]
+            setattr(self, name, array)
+        self.instance_data = np.empty((capacity, self.instance_floats), dtype=np.float32)
+
+    # Destroy callback of the cube field: cube i becomes a particle
+    def cube_destroyed(self, i):
+        if self.count == self.capacity:
+            self.allocate(2 * self.capacity)
+        n = self.count
+        field = self.field
+        self.positions[n] = field.origin + field.offsets[i]
+        self.previous_positions[n] = field.previous_origin + field.previous_offsets[i]
+        self.velocities[n] = field.velocities[i]
+        axis = np.random.normal(size=3)
+        self.axes[n] = axis / np.linalg.norm(axis)
+        self.angles[n] = self.previous_angles[n] = 0.0
+        self.spins[n] = field.angular_velocity[i]
+        self.ages[n] = 0.0
+        self.count = n + 1
+
+    # Retire every particle (e.g. when the body is reset)
+    def clear(self):
+        self.count = 0
+
+    # Remember the current state before a simulation step changes it
+    def save_state(self):
+        n = self.count
+        self.previous_positions[:n] = self.positions[:n]
+        self.previous_angles[:n] = self.angles[:n]
+
+    # Advance every particle at once and retire the expired ones
+    def update(self, delta_time):
+        n = self.count
+        if n == 0:
+            return
+        ages = self.ages[:n]
+        ages += delta_time
+        # Only the part of this step after the flash moves a fragment
+        moving_time = np.clip(ages - self.flash_duration, 0.0, delta_time)
+        self.positions[:n] += self.velocities[:n] * moving_time[:, None]
+        self.angles[:n] += self.spins[:n] * moving_time
+
+        expired = ages >= self.lifetime
+        if expired.any():
+            keep = np.flatnonzero(~expired)
+            for array in (self.positions, self.previous_positions, self.velocities, self.axes,
+                          self.angles, self.previous_angles, self.spins, self.ages):
+                array[:len(keep)] = array[keep]
+            self.count = len(keep)
+            cube_common.log.count('debris retired', n - len(keep))
+
+    # Fragment opacity: opaque until the last fade_time seconds of its life
+    def alphas(self):
+        n = self.count
+        return np.minimum((self.lifetime - self.ages[:n]) / self.fade_time, 1.0)
+
+    # alpha blends between the last two simulation steps (see GameClock);
+    # with a FrustumCuller only the fragments in view are drawn
+    def draw(self, alpha=1.0, culler=None):
+        n = self.count
+        if n == 0:
+            return
+        positions = self.previous_positions[:n] + (self.positions[:n] - self.previous_positions[:n]) * alpha
+        angles = self.previous_angles[:n] + (self.angles[:n] - self.previous_angles[:n]) * alpha
+        axes = self.axes[:n]
+        alphas = self.alphas()
+        if culler is not None:
+            # A spinning unit cube stays within half its diagonal of its center
+            visible = culler.visible('debris', positions * step - 0.87, positions * step + 0.87)
+            positions, angles, axes, alphas = positions[visible], angles[visible], axes[visible], alphas[visible]
+            n = len(positions)
+            if n == 0:
+                return
 
-    # Reset the cube's animation state
-    def reset_animation_state(self):
-        self.color = self.random_color()
-        self.is_destroyed = False
-        self.velocity = [0.0, 0.0, 0.0]
-        self.angular_velocity = 0.0
+        glEnable(GL_BLEND)
+        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+        if self.program is not None:
+            data = self.instance_data[:n]
+            data[:, 0:3] = positions * step
+            data[:, 3:6] = axes
+            data[:, 6] = np.radians(angles)
+            data[:, 7:10] = 1.0  # White, like the flash of a destroyed cube
+            data[:, 10] = alphas
+
+            glBindBuffer(GL_ARRAY_BUFFER, self.instance_vbo)
+            glBufferData(GL_ARRAY_BUFFER, data.nbytes, data, GL_STREAM_DRAW)
+            glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+            glUseProgram(self.program)
+            glBindVertexArray(self.vao)
+            glDrawElementsInstanced(GL_TRIANGLES, cube_index_count, GL_UNSIGNED_INT, None, n)
+            glBindVertexArray(0)
+            glUseProgram(0)
+        elif not use_core_profile:
+            # One draw per fragment when shaders are unavailable
+            glBindVertexArray(vao)
+            for (x, y, z), (ax, ay, az), angle, fade in zip((positions * step).tolist(), axes.tolist(),
+                                                           angles.tolist(), alphas.tolist()):
+                glPushMatrix()
+                glTranslatef(x, y, z)
+                glRotatef(angle, ax, ay, az)
+                glColor4f(1.0, 1.0, 1.0, fade)
+                glDrawElements(GL_TRIANGLES, cube_index_count, GL_UNSIGNED_INT, None)
+                glPopMatrix()
+            glBindVertexArray(0)
+        glDisable(GL_BLEND)
+
+# DebrisSystem with the particle state kept on the GPU, for very large shatters.
+# Position/age, velocity/spin and axis/angle live in two buffers that a
+# transform feedback pass ping-pongs between every simulation step, so only
+# newly destroyed cubes are uploaded (in one batch per step). All particles
+# share one lifetime and are appended in spawn order, so the expired ones are
+# always at the front: retiring them just moves `start` forward, and the live
+# range is copied back to the front of the other buffer when the end is reached.
+class GPUDebrisSystem:
+    state_floats = 12
+
+    def __init__(self, field, update_program, render_program, lifetime=debris_lifetime, fade_time=1.0,
+                 capacity=4096):
+        self.field = field
+        self.update_program = update_program
+        self.render_program = render_program
+        self.lifetime = lifetime
+        self.fade_time = fade_time
+        self.flash_duration = field.flash_duration
+        self.capacity = capacity
+        self.start = 0  # Live particles are start..end of the current buffer
+        self.end = 0
+        self.time = 0.0
+        self.spawn_times = np.zeros(capacity)  # Simulation time each particle was spawned at
+        self.delta_time = 0.0  # Length of the last step, for render interpolation
+        self.pending = np.zeros((64, self.state_floats), dtype=np.float32)  # Spawned since the last update
+        self.pending_count = 0
+
+        self.update_locations = {name: glGetUniformLocation(update_program, name)
+                                 for name in ('delta_time', 'flash_duration')}
+        self.render_locations = {name: glGetUniformLocation(render_program, name)
+                                 for name in ('alpha', 'delta_time', 'flash_duration', 'lifetime', 'fade_time', 'step')}
+
+        self.buffers = list(glGenBuffers(2))
+        for buffer in self.buffers:
+            glBindBuffer(GL_ARRAY_BUFFER, buffer)
+            glBufferData(GL_ARRAY_BUFFER, capacity * self.state_floats * 4, None, GL_DYNAMIC_COPY)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        self.current = 0
+
+        self.update_vao = glGenVertexArrays(1)
+        glBindVertexArray(self.update_vao)
+        for location in range(3):
+            glEnableVertexAttribArray(location)
+        self.render_vao = glGenVertexArrays(1)
+        glBindVertexArray(self.render_vao)
+        glBindBuffer(GL_ARRAY_BUFFER, vbo)
+        glEnableVertexAttribArray(0)
+        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 0, None)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, cube_index_buffer)
+        for location in range(1, 4):
+            glEnableVertexAttribArray(location)
+            glVertexAttribDivisor(location, 1)
+        glBindVertexArray(0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+        field.destroy_callbacks.append(self.cube_destroyed)
+
+    @property
+    def count(self):
+        return self.end - self.start + self.pending_count
+
+    # Point attributes first_location.. at the state of particle `first` in `buffer`
+    def bind_state(self, buffer, first, first_location):
+        stride = self.state_floats * 4
+        glBindBuffer(GL_ARRAY_BUFFER, buffer)
+        for i in range(3):
+            glVertexAttribPointer(first_location + i, 4, GL_FLOAT, GL_FALSE, stride,
+                                  ctypes.c_void_p(first * stride + i * 16))
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    # Destroy callback of the cube field: queue cube i as a new particle
+    def cube_destroyed(self, i):
+        if self.pending_count == len(self.pending):
+            self.pending = np.concatenate([self.pending, np.zeros_like(self.pending)])
+        field = self.field
+        axis = np.random.normal(size=3)
+        row = self.pending[self.pending_count]
+        row[0:3] = field.origin + field.offsets[i]
+        row[3] = 0.0  # Age
+        row[4:7] = field.velocities[i]
+        row[7] = field.angular_velocity[i]
+        row[8:11] = axis / np.linalg.norm(axis)
+        row[11] = 0.0  # Angle
+        self.pending_count += 1
+
+    # Move the live particles to the front of the other buffer (growing both
+    # buffers if they still would not fit `extra` more) and make it current
+    def compact(self, extra):
+        live = self.end - self.start
+        capacity = self.capacity
+        while live + extra > capacity:
+            capacity *= 2
+        stride = self.state_floats * 4
+        target = self.buffers[1 - self.current]
+        if capacity != self.capacity:
+            glBindBuffer(GL_COPY_WRITE_BUFFER, target)
+            glBufferData(GL_COPY_WRITE_BUFFER, capacity * stride, None, GL_DYNAMIC_COPY)
+        glBindBuffer(GL_COPY_READ_BUFFER, self.buffers[self.current])
+        glBindBuffer(GL_COPY_WRITE_BUFFER, target)
+        if live:
+            glCopyBufferSubData(GL_COPY_READ_BUFFER, GL_COPY_WRITE_BUFFER, self.start * stride, 0, live * stride)
+        if capacity != self.capacity:
+            glBufferData(GL_COPY_READ_BUFFER, capacity * stride, None, GL_DYNAMIC_COPY)
+            spawn_times = np.zeros(capacity)
+            spawn_times[:live] = self.spawn_times[self.start:self.end]
+            self.spawn_times = spawn_times
+            self.capacity = capacity
+        else:
+            self.spawn_times[:live] = self.spawn_times[self.start:self.end]
+        glBindBuffer(GL_COPY_READ_BUFFER, 0)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, 0)
+        self.current = 1 - self.current
+        self.start, self.end = 0, live
+
+    # Upload the particles spawned since the last update in one call
+    def flush_pending(self):
+        n = self.pending_count
+        if self.end + n > self.capacity:
+            self.compact(n)
+        data = self.pending[:n]
+        glBindBuffer(GL_ARRAY_BUFFER, self.buffers[self.current])
+        glBufferSubData(GL_ARRAY_BUFFER, self.end * data[0].nbytes, data.nbytes, data)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        self.spawn_times[self.end:self.end + n] = self.time
+        self.end += n
+        self.pending_count = 0
+
+    # Retire every particle (e.g. when the body is reset)
+    def clear(self):
+        self.start = self.end = self.pending_count = 0
+
+    # Nothing to remember: draw() recovers the previous step from the velocity
+    def save_state(self):
+        pass
+
+    # Advance every particle with one transform feedback pass and retire the expired ones
+    def update(self, delta_time):
+        if self.pending_count:
+            self.flush_pending()
+        self.time += delta_time
+        self.delta_time = delta_time
+        if self.end == self.start:
+            return
+
+        stride = self.state_floats * 4
+        glUseProgram(self.update_program)
+        glUniform1f(self.update_locations['delta_time'], delta_time)
+        glUniform1f(self.update_locations['flash_duration'], self.flash_duration)
+        glBindVertexArray(self.update_vao)
+        self.bind_state(self.buffers[self.current], 0, 0)
+        glBindBufferRange(GL_TRANSFORM_FEEDBACK_BUFFER, 0, self.buffers[1 - self.current],
+                          self.start * stride, (self.end - self.start) * stride)
+        glEnable(GL_RASTERIZER_DISCARD)
+        glBeginTransformFeedback(GL_POINTS)
+        glDrawArrays(GL_POINTS, self.start, self.end - self.start)
+        glEndTransformFeedback()
+        glDisable(GL_RASTERIZER_DISCARD)
+        glBindBufferBase(GL_TRANSFORM_FEEDBACK_BUFFER, 0, 0)
+        glBindVertexArray(0)
+        glUseProgram(0)
+        self.current = 1 - self.current
+
+        # Particles spawned at or before this time have reached their lifetime
+        expired = np.searchsorted(self.spawn_times[self.start:self.end], self.time - self.lifetime + 1e-9, side='right')
+        if expired:
+            self.start += int(expired)
+            cube_common.log.count('debris retired', int(expired))
+
+    # alpha blends between the last two simulation steps (see GameClock); the
+    # particle state never leaves the GPU, so the culler is not used here
+    def draw(self, alpha=1.0, culler=None):
+        live = self.end - self.start
+        if live == 0:
+            return
+        locations = self.render_locations
+        glEnable(GL_BLEND)
+        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+        glUseProgram(self.render_program)
+        glUniform1f(locations['alpha'], alpha)
+        glUniform1f(locations['delta_time'], self.delta_time)
+        glUniform1f(locations['flash_duration'], self.flash_duration)
+        glUniform1f(locations['lifetime'], self.lifetime)
+        glUniform1f(locations['fade_time'], self.fade_time)
+        glUniform1f(locations['step'], step)
+        glBindVertexArray(self.render_vao)
+        self.bind_state(self.buffers[self.current], self.start, 1)
+        glDrawElementsInstanced(GL_TRIANGLES, cube_index_count, GL_UNSIGNED_INT, None, live)
+        glBindVertexArray(0)
+        glUseProgram(0)
+        glDisable(GL_BLEND)
 
 # start position variable
 start_position = (-18.0, 0.0, -18.0)  # For example, near the edge of the horizon grid
+if level is not None:
+    start_position = level.start_position
 
 # When initializing cubes, incorporate the start_position offset:
-cubes = [[[Cube(x + start_position[0], 
-                 y + start_position[1], 
-                 z + start_position[2]) 
-           for z in range(-cube_size // 2, cube_size // 2)]
-          for y in range(-cube_size // 2, cube_size // 2)]
-         for x in range(-cube_size // 2, cube_size // 2)]
+cube_field = CubeField(cube_size, start_position)
+
+# Draw the intact cubes as one mesh of their exposed faces (toggle with the C key)
+use_face_culling = use_instanced_rendering
+body_mesh = None
+try:
+    body_mesh_program = cube_common.shader_cache.get(body_mesh_vertex_shader, instanced_fragment_shader,
+                                                     ['position', 'cube_y'])
+    body_mesh = BodyMesh(cube_field, body_mesh_program, gradient_lut)
+except (OpenGL.error.GLError, OpenGL.error.NullFunctionError, RuntimeError) as e:
+    cube_common.log.warning("Face-culled body mesh unavailable: %s", e)
+    use_face_culling = False
+
+# Destroyed cubes fly off as particles (drawn one at a time if the shader fails)
+debris_program = None
+try:
+    debris_program = cube_common.shader_cache.get(debris_vertex_shader, instanced_fragment_shader,
+                                                  ['position', 'instance_offset', 'instance_rotation',
+                                                   'instance_color'])
+except (OpenGL.error.GLError, OpenGL.error.NullFunctionError, RuntimeError) as e:
+    cube_common.log.warning("Instanced debris unavailable, drawing one fragment at a time: %s", e)
+
+# Set CUBE_LIBRE_GPU_DEBRIS=1 to keep the debris physics on the GPU (transform feedback)
+debris = None
+if os.environ.get('CUBE_LIBRE_GPU_DEBRIS', '0') == '1':
+    try:
+        gpu_debris_update_program = cube_common.shader_cache.get(
+            gpu_debris_update_shader, None, ['position_age', 'velocity_spin', 'axis_angle'],
+            feedback_varyings=['next_position_age', 'next_velocity_spin', 'next_axis_angle'])
+        gpu_debris_render_program = cube_common.shader_cache.get(
+            gpu_debris_vertex_shader, instanced_fragment_shader,
+            ['position', 'position_age', 'velocity_spin', 'axis_angle'])
+        debris = GPUDebrisSystem(cube_field, gpu_debris_update_program, gpu_debris_render_program)
+        print("[INFO] Debris physics: GPU (transform feedback)")
+    except (OpenGL.error.GLError, OpenGL.error.NullFunctionError, RuntimeError) as e:
+        cube_common.log.warning("GPU debris unavailable, integrating debris on the CPU: %s", e)
+if debris is None:
+    debris = DebrisSystem(cube_field, debris_program)
+
+# The laser maze: beams sweeping back and forth that destroy every cube they touch.
+# Every step all beams are tested against every intact cube at once (see
+# cube_common.boxes_hit_by_segments), after dropping the beams whose bounding
+# boxes miss the body's; all beams are drawn as lines from one buffer.
+class LaserField:
+    def __init__(self, field, lasers, program, color=laser_color, line_width=laser_width):
+        self.field = field
+        self.program = program
+        self.color = color
+        self.line_width = line_width
+        self.starts = lasers['start'].astype(np.float64)
+        self.ends = lasers['end'].astype(np.float64)
+        self.sweeps = lasers['sweep'].astype(np.float64)
+        self.frequencies = 2.0 * np.pi / np.maximum(lasers['period'].astype(np.float64), 1e-6)
+        self.count = len(lasers)
+        self.time = 0.0
+        self.offsets = np.zeros((self.count, 3))
+        self.previous_offsets = np.zeros((self.count, 3))
+        self.vertices = np.empty((self.count, 2, 3), dtype=np.float32)
+
+        if program is not None:
+            self.color_location = glGetUniformLocation(program, 'color')
+        self.vao = glGenVertexArrays(1)
+        glBindVertexArray(self.vao)
+        self.vbo = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glEnableVertexAttribArray(0)  # Attribute 0 aliases the fixed-function vertex position
+        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 3 * 4, ctypes.c_void_p(0))
+        glBindVertexArray(0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def save_state(self):
+        np.copyto(self.previous_offsets, self.offsets)
+
+    # Cubes (indices into the field) touched by a beam right now
+    def hit_cubes(self):
+        live = np.flatnonzero(~self.field.is_destroyed)
+        if self.count == 0:
+            return live[:0]  # A level without beams hits nothing
+        if len(live) == 0:
+            return live
+        centers = self.field.positions[live] * step
+        box_min, box_max = centers - 0.5, centers + 0.5
+        starts, ends = self.starts + self.offsets, self.ends + self.offsets
+        near = np.all((np.minimum(starts, ends) <= box_max.max(axis=0))
+                      & (np.maximum(starts, ends) >= box_min.min(axis=0)), axis=1)
+        hit = cube_common.boxes_hit_by_segments(starts[near], ends[near], box_min, box_max)
+        return live[hit]
+
+    # Sweep the beams and destroy the cubes they touch; returns how many were hit
+    def update(self, delta_time):
+        self.time += delta_time
+        self.offsets = self.sweeps * np.sin(self.frequencies * self.time)[:, None]
+        hit = self.hit_cubes()
+        for i in hit.tolist():
+            self.field.destroy(i)
+        if len(hit):
+            cube_common.log.count('laser hits', len(hit))
+        return len(hit)
+
+    # alpha blends between the last two simulation steps (see GameClock);
+    # with a FrustumCuller only the beams in view are uploaded
+    def draw(self, alpha=1.0, culler=None):
+        if self.count == 0:
+            return
+        offsets = self.previous_offsets + (self.offsets - self.previous_offsets) * alpha
+        vertices = self.vertices
+        vertices[:, 0] = self.starts + offsets
+        vertices[:, 1] = self.ends + offsets
+        if culler is not None:
+            vertices = vertices[culler.visible('lasers', vertices.min(axis=1), vertices.max(axis=1))]
+            if len(vertices) == 0:
+                return
+
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL_STREAM_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glLineWidth(self.line_width)
+        if self.program is not None:
+            glUseProgram(self.program)
+            glUniform4f(self.color_location, *self.color, 1.0)
+        else:
+            glColor3f(*self.color)
+        glBindVertexArray(self.vao)
+        glDrawArrays(GL_LINES, 0, 2 * len(vertices))
+        glBindVertexArray(0)
+        if self.program is not None:
+            glUseProgram(0)
+
+laser_program = None
+try:
+    laser_program = cube_common.shader_cache.get(cube_common.line_vertex_shader, cube_common.color_fragment_shader,
+                                                 ['position'])
+except (OpenGL.error.GLError, OpenGL.error.NullFunctionError, RuntimeError) as e:
+    cube_common.log.warning("Laser shader unavailable, drawing the beams with the fixed pipeline: %s", e)
+laser_field = LaserField(cube_field, lasers, laser_program)
 
 # # Initialize cubes (no variables)
 # cubes = [[[Cube(x, y, z) for z in range(-cube_size // 2, cube_size // 2)] 
@@ -275,6 +1185,10 @@ default_move_speed = 0.1
 
 # Assuming the horizon is at a fixed Y-coordinate
 horizon_y = -5
+horizon_extent = 20  # The wireframe grid spans -extent..extent in x and z
+horizon_step = 2
+if level is not None:
+    horizon_y, horizon_extent, horizon_step = level.horizon_y, level.grid_extent, level.grid_step
 
 # Initialize a destruction timer
 destruction_cooldown = 0.0
@@ -283,18 +1197,11 @@ max_destruction_rate = 0.5  # 1.0 = One cube per second
 # Define the number of stars
 num_stars = 1000
 
-# Generate random positions for stars
-stars = [(random.uniform(-50, 50), random.uniform(-50, 50), random.uniform(-50, 50)) for _ in range(num_stars)]
-
-def draw_stars():
-    glPointSize(2)  # Adjust point size for visibility
-    glBegin(GL_POINTS)
-    for star in stars:
-        glVertex3fv(star)
-    glEnd()
+# Random star positions, uploaded once (scroll with starfield.scroll)
+starfield = cube_common.Starfield(num_stars, extent=50, camera=camera, tiles=4)
 
 # draw the portal
-def draw_portal():
+def draw_portal(size=portal_size):
     glPushMatrix()
     # No glTranslatef here!    
     # glTranslatef(*portal_position)
@@ -306,7 +1213,7 @@ def draw_portal():
     # Draw the main portal quad
     glColor4f(*portal_color, 1.0)  # Full opacity for the main portal
     glBegin(GL_QUADS)
-    half_size = portal_size / 2
+    half_size = size / 2
     glVertex3f(-half_size, -half_size, 0.0)
     glVertex3f(half_size, -half_size, 0.0)
     glVertex3f(half_size, half_size, 0.0)
@@ -331,20 +1238,104 @@ def draw_portal():
     glDisable(GL_BLEND)
     glPopMatrix()
 
-# Movement function updated for x and y directions
-def move_cubes(delta_x, delta_y):
-    for row in cubes:
-        for layer in row:
-            for cube in layer:
-                cube.x += delta_x
-                cube.y += delta_y
-
-# horizon collision detection
-def check_collision_with_horizon(cube):
-    if cube.y <= horizon_y:
-        print(f"Collision detected for cube at ({cube.x}, {cube.y}, {cube.z})")
-        return True
-    return False
+# Portal quads with the glow baked in as per-vertex alpha; every portal is an instance
+portal_vertex_shader = cube_common.core_shader_header + """
+in vec3 position;
+in vec4 vertex_color;
+in vec3 instance_offset;
+in float instance_size;
+out vec4 color;
+void main() {
+    color = vertex_color;
+    gl_Position = view_projection * vec4(position * instance_size + instance_offset, 1.0);
+}
+"""
+
+# All portals in one draw call (draw_portal is the immediate-mode fallback)
+#
+# The main quad and its glow layers are built once into a VBO in the same
+# order draw_portal uses, so the depth test keeps only the outer ring of each
+# glow layer just like before. The quads are built for a portal of size 1, and
+# each portal's position and size go into an instance buffer.
+class PortalRenderer:
+    vertex_floats = 7  # x, y, z, r, g, b, a
+    instance_floats = 4  # x, y, z, size
+
+    def __init__(self, program, positions, sizes, color=portal_color,
+                 glow_steps=portal_glow_steps, glow_alpha=portal_glow_alpha):
+        self.program = program
+
+        # Layer 0 is the opaque portal, then the growing, fading glow layers
+        scales = np.array([1.0] + [1.0 + i * 0.2 for i in range(1, glow_steps + 1)])
+        alphas = np.array([1.0] + [glow_alpha / i for i in range(1, glow_steps + 1)])
+        corners = np.array([(-0.5, -0.5, 0.0), (0.5, -0.5, 0.0), (0.5, 0.5, 0.0), (-0.5, 0.5, 0.0)])
+        vertices = np.empty((len(scales), 4, self.vertex_floats), dtype=np.float32)
+        vertices[:, :, 0:3] = scales[:, None, None] * corners
+        vertices[:, :, 3:6] = color
+        vertices[:, :, 6] = alphas[:, None]
+        self.index_count = 6 * len(scales)
+
+        self.vao = glGenVertexArrays(1)
+        glBindVertexArray(self.vao)
+        self.vbo = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL_STATIC_DRAW)
+        stride = self.vertex_floats * 4
+        glEnableVertexAttribArray(0)
+        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(0))
+        glEnableVertexAttribArray(1)
+        glVertexAttribPointer(1, 4, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(3 * 4))
+
+        self.instance_vbo = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, self.instance_vbo)
+        instance_stride = self.instance_floats * 4
+        glEnableVertexAttribArray(2)
+        glVertexAttribPointer(2, 3, GL_FLOAT, GL_FALSE, instance_stride, ctypes.c_void_p(0))
+        glVertexAttribDivisor(2, 1)
+        glEnableVertexAttribArray(3)
+        glVertexAttribPointer(3, 1, GL_FLOAT, GL_FALSE, instance_stride, ctypes.c_void_p(3 * 4))
+        glVertexAttribDivisor(3, 1)
+        self.index_buffer = cube_common.create_index_buffer(cube_common.quad_indices(len(scales)))
+        glBindVertexArray(0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+        self.set_portals(positions, sizes)
+
+    # Replace the portals' positions and sizes (e.g. when a level is loaded)
+    def set_portals(self, positions, sizes):
+        instances = np.empty((len(positions), self.instance_floats), dtype=np.float32)
+        instances[:, 0:3] = np.asarray(positions, dtype=np.float32).reshape(-1, 3)
+        instances[:, 3] = sizes
+        self.portal_count = len(instances)
+        glBindBuffer(GL_ARRAY_BUFFER, self.instance_vbo)
+        glBufferData(GL_ARRAY_BUFFER, instances.nbytes, instances, GL_STATIC_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def draw(self):
+        glEnable(GL_BLEND)
+        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+        glUseProgram(self.program)
+        glBindVertexArray(self.vao)
+        glDrawElementsInstanced(GL_TRIANGLES, self.index_count, GL_UNSIGNED_INT, None, self.portal_count)
+        glBindVertexArray(0)
+        glUseProgram(0)
+        glDisable(GL_BLEND)
+
+portal_renderer = None
+try:
+    portal_program = cube_common.shader_cache.get(portal_vertex_shader, instanced_fragment_shader,
+                                                  ['position', 'vertex_color', 'instance_offset', 'instance_size'])
+    portal_renderer = PortalRenderer(portal_program, portal_positions, portal_sizes)
+except (OpenGL.error.GLError, OpenGL.error.NullFunctionError, RuntimeError) as e:
+    cube_common.log.warning("Batched portal rendering unavailable, drawing the glow layer by layer: %s", e)
+
+# The core profile has no fixed-function pipeline to fall back on: whatever lacks its shader is not drawn
+if use_core_profile:
+    undrawable = [name for name, shader_path in (('cubes', instance_program), ('debris', debris_program),
+                                                 ('lasers', laser_program), ('portals', portal_renderer))
+                  if shader_path is None]
+    if undrawable:
+        cube_common.log.warning("No fixed-function fallback in the core profile, not drawing the %s", ', '.join(undrawable))
 
 # Update cube positions based on velocity
 def update_cubes(delta_time):
@@ -353,19 +1344,8 @@ def update_cubes(delta_time):
     #if screen_shake_timer > 0:
     #    screen_shake_timer -= delta_time
     if flash_timer > 0:
-        flash_timer -= delta_time    
-    for x in range(-cube_size // 2, cube_size // 2):
-        for y in range(-cube_size // 2, cube_size // 2):
-            for z in range(-cube_size // 2, cube_size // 2):
-                cube = cubes[x][y][z]
-                if cube.is_destroyed:
-                    cube.time_since_destroyed += delta_time
-                    if cube.time_since_destroyed > cube.flash_duration:
-                        # Only move cubes after the flash duration
-                        cube.x += cube.velocity[0] * delta_time
-                        cube.y += cube.velocity[1] * delta_time
-                        cube.z += cube.velocity[2] * delta_time
-                        cube.rotation += cube.angular_velocity * delta_time  # This line should now work
+        flash_timer -= delta_time
+    debris.update(delta_time)
 
     """ # Render the scene multiple times with decreasing opacity to simulate motion blur
     for i in range(3):
@@ -377,63 +1357,109 @@ def update_cubes(delta_time):
         draw_scene()
         glPopMatrix() """
 
-# draw the wireframe horizon
-def draw_wireframe_horizon():
-    glColor3f(1.0, 1.0, 1.0)  # White color
-    glLineWidth(1)  # Set line width
-    glBegin(GL_LINES)
-
-    # Horizontal lines
-    for z in range(-20, 21, 2):  # Adjust range and step for density
-        glVertex3f(-20, -5, z)  # Adjust Y-coordinate for vertical position
-        glVertex3f(20, -5, z)
+# The wireframe horizon, built once into a static VBO
+horizon_grid = cube_common.HorizonGrid(extent=horizon_extent, step=horizon_step, y=horizon_y, camera=camera, chunks=4)
 
-    # Vertical lines
-    for x in range(-20, 21, 2):  # Adjust range and step for density
-        glVertex3f(x, -5, -20)  # Starting from far distance
-        glVertex3f(x, -5, 20)   # Up to close distance
+# Skip the cubes, debris, star tiles and grid chunks outside the view (toggle with the F key)
+use_frustum_culling = True
+frustum = cube_common.FrustumCuller()
 
-    glEnd()
+# The level's obstacles (see level_path), streamed in chunks around the body
+world = None
+if level_path:
+    try:
+        source = level if level is not None else cube_level.ChunkDirectory(level_path)
+        world = cube_common.ChunkedWorld(source, load_radius=1, capacity=64, camera=camera)
+    except (OSError, ValueError, KeyError) as e:
+        cube_common.log.warning("Could not open level %s: %s", level_path, e)
+
+# Whether an intact cube overlaps a level obstacle with the body origin at `origin`.
+# The SpatialHash of the resident chunks (world.obstacles) narrows the obstacles
+# down to those near the body before the cubes are tested against them.
+def body_hits_obstacle(origin):
+    centers = (origin + cube_field.offsets[~cube_field.is_destroyed]) * step
+    if len(centers) == 0:
+        return False
+    cube_min, cube_max = centers - 0.5, centers + 0.5
+    boxes = world.touching(cube_min.min(axis=0), cube_max.max(axis=0))
+    if len(boxes) == 0:
+        return False
+    overlap = (cube_min[:, None] < boxes[None, :, 1]) & (cube_max[:, None] > boxes[None, :, 0])
+    return bool(overlap.all(axis=2).any())
+
+# The part of a move that keeps the body out of the level's obstacles, taken axis
+# by axis so the body slides along walls (a body already stuck in one moves freely)
+def blocked_move(move_x, move_y, move_z):
+    move = [move_x, move_y, move_z]
+    origin = cube_field.origin.copy()
+    if world is None or body_hits_obstacle(origin):
+        return move
+    for axis in range(3):
+        if move[axis]:
+            origin[axis] += move[axis]
+            if body_hits_obstacle(origin):
+                origin[axis] -= move[axis]
+                move[axis] = 0.0
+                cube_common.log.count('obstacle collisions')
+    return move
 
 def destroy_one_cube_per_layer():
-    global screen_shake_timer, flash_timer  # Ensure these globals are declared if needed
-    # Iterate through each layer
-    for y in range(-cube_size // 2, cube_size // 2):
-        layer_affected = False
-        for x in range(-cube_size // 2, cube_size // 2):
-            for z in range(-cube_size // 2, cube_size // 2):
-                cube = cubes[x][y][z]
-                if cube and not cube.is_destroyed and check_collision_with_horizon(cube):
-                    if not layer_affected:
-                        # Choose a random cube to destroy
-                        random_x = random.randint(-cube_size // 2, cube_size // 2 - 1)
-                        random_z = random.randint(-cube_size // 2, cube_size // 2 - 1)
-                        cubes[random_x][y][random_z].destroy()  # Call destroy method
-                        layer_affected = True
-                    break
-        if layer_affected:
-            trigger_hit_effects()  # Trigger effects when a cube is destroyed
-
-def gradient_color(y):
-    # Assuming the vertical range is from -cube_size/2 to cube_size/2
-    gradient_start = [1, 0, 0] # Red at the top
-    gradient_end = [0, 0, 1] # Blue at the bottom
-    factor = (y + cube_size/2) / cube_size # Normalize y to range [0, 1]
-    color = [
-        gradient_start[0] * (1 - factor) + gradient_end[0] * factor,
-        gradient_start[1] * (1 - factor) + gradient_end[1] * factor,
-        gradient_start[2] * (1 - factor) + gradient_end[2] * factor
-    ]
-    return color
-
-def update_star_positions(offset_x, offset_y, offset_z):
-    global stars
-    stars = [(x + offset_x, y + offset_y, z + offset_z) for (x, y, z) in stars]
-
-def draw_scene():
+    # Layers whose lowest intact cube touches the horizon, in one vectorized test
+    hit_layers = np.flatnonzero(cube_field.layer_min_y() <= horizon_y)
+    for layer in hit_layers:
+        cube_common.log.count('horizon collisions')
+        cube_common.log.debug("Collision detected for layer %d", layer)
+        # Destroy a random cube that is still intact in this layer
+        cube_field.destroy(cube_field.random_live_cube(layer))
+    if len(hit_layers):
+        trigger_hit_effects()  # Trigger effects when a cube is destroyed
+
+
+# Draw every intact small cube with one instanced draw call
+# (destroyed cubes are drawn by the debris system); with a FrustumCuller
+# only the cubes in view are uploaded
+def draw_cubes_instanced(alpha=1.0, culler=None):
+    positions = cube_field.interpolated_positions(alpha)[~cube_field.is_destroyed]
+    if culler is not None:
+        positions = positions[culler.visible('cubes', positions * step - 0.5, positions * step + 0.5)]
+    if len(positions) == 0:
+        return
+
+    instance_data = np.empty((len(positions), instance_floats), dtype=np.float32)
+    instance_data[:, 0:3] = positions * step
+    instance_data[:, 3:6] = gradient_lut.colors(positions[:, 1])
+    instance_data[:, 6] = 1.0
+
+    glBindBuffer(GL_ARRAY_BUFFER, instance_vbo)
+    glBufferData(GL_ARRAY_BUFFER, instance_data.nbytes, instance_data, GL_STREAM_DRAW)
+    glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    glUseProgram(instance_program)
+    glBindVertexArray(vao)
+    glDrawElementsInstanced(GL_TRIANGLES, cube_index_count, GL_UNSIGNED_INT, None, len(instance_data))
+    glBindVertexArray(0)
+    glUseProgram(0)
+
+# Draw the small cubes one at a time (the pre-instancing path, kept for comparison)
+def draw_cubes_per_cube(alpha=1.0):
+    # Apply gradient in the cube rendering loop
+    glBindVertexArray(vao)
+    positions = cube_field.interpolated_positions(alpha)
+    for (x, y, z), is_destroyed in zip(positions.tolist(), cube_field.is_destroyed.tolist()):
+        if is_destroyed:
+            continue  # Flying off as debris
+        glPushMatrix()
+        glTranslatef(x * step, y * step, z * step)
+        glColor3fv(gradient_lut.color(y))
+        glDrawElements(GL_TRIANGLES, cube_index_count, GL_UNSIGNED_INT, None)
+        glPopMatrix()
+    glBindVertexArray(0)
+
+# alpha blends between the last two simulation steps (see GameClock);
+# shake is the screen shake offset of this frame
+def draw_scene(alpha=1.0, shake=(0.0, 0.0)):
     # Rendering
     glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-    glPushMatrix()
 
     # # Portal drawing, isolated:
     # glPushMatrix()  # Portal push #B
@@ -441,41 +1467,54 @@ def draw_scene():
     # draw_portal()
     # glPopMatrix()   # Pop #B (portal done)    
 
-    # Rotate the entire scene
-    glRotatef(angle_x, 1, 0, 0)
-    glRotatef(angle_y, 0, 1, 0)
-    glRotatef(angle_z, 0, 0, 1)
+    # Camera: pulled back and shaken, with the entire scene rotated in front of it
+    view = cube_common.translation_matrix(shake[0], shake[1], -camera_distance)
+    view = view @ cube_common.rotation_matrix(previous_angle_x + (angle_x - previous_angle_x) * alpha, 1, 0, 0)
+    view = view @ cube_common.rotation_matrix(previous_angle_y + (angle_y - previous_angle_y) * alpha, 0, 1, 0)
+    view = view @ cube_common.rotation_matrix(previous_angle_z + (angle_z - previous_angle_z) * alpha, 0, 0, 1)
+    camera.set_view(view)
+    culler = None
+    if use_frustum_culling:
+        frustum.update(camera.view_projection)
+        culler = frustum
 
     # Draw the portal now
-    glPushMatrix()
-    glTranslatef(*portal_position)
-    draw_portal()
-    glPopMatrix()
+    if portal_renderer is not None:
+        portal_renderer.draw()
+    elif not use_core_profile:
+        for position, size in zip(portal_positions, portal_sizes):
+            glPushMatrix()
+            glTranslatef(*position)
+            draw_portal(size)
+            glPopMatrix()
 
     # Draw wireframe horizon
-    draw_wireframe_horizon()
-
-    # Draw stars
-    glColor3f(1, 1, 1)  # White stars
-    draw_stars()
-
-    # Apply gradient in the cube rendering loop
-    for x in range(-cube_size // 2, cube_size // 2):
-        for y in range(-cube_size // 2, cube_size // 2):
-            for z in range(-cube_size // 2, cube_size // 2):
-                cube = cubes[x][y][z]
-                glPushMatrix()
-                glTranslatef(cube.x * step, cube.y * step, cube.z * step)
-                if cube.is_destroyed:
-                    # Render the cube with a different style if it's destroyed
-                    glColor4f(1.0, 1.0, 1.0, 0.5)  # Example: white and semi-transparent
-                else:
-                    gradient_color_value = gradient_color(cube.y)
-                    glColor3fv(gradient_color_value)
-                glBindVertexArray(vao)
-                glDrawArrays(GL_QUADS, 0, 24)
-                glBindVertexArray(0)
-                glPopMatrix()
+    horizon_grid.draw(culler)
+
+    # Draw stars (white, see starfield)
+    starfield.draw(culler)
+
+    # Draw the obstacles of the level chunks around the body
+    if world is not None:
+        world.draw(culler)
+
+    # Draw the laser beams
+    if laser_program is not None or not use_core_profile:
+        laser_field.draw(alpha, culler)
+
+    # Draw the small cubes
+    if use_instanced_rendering and use_face_culling:
+        body_origin = cube_field.previous_origin + (cube_field.origin - cube_field.previous_origin) * alpha
+        # The whole mesh is one draw, so it is culled as one box around the body
+        body_min = ((body_origin + cube_field.grid_coords[0]) * step - 0.5)[None]
+        body_max = ((body_origin + cube_field.grid_coords[-1]) * step + 0.5)[None]
+        if culler is None or culler.visible('cubes', body_min, body_max)[0]:
+            body_mesh.draw(body_origin)
+    elif use_instanced_rendering:
+        draw_cubes_instanced(alpha, culler)
+    elif not use_core_profile:
+        draw_cubes_per_cube(alpha)
+    debris.draw(alpha, culler)
 
     # # Draw cubes with rotation around their own center
     # for x in range(-cube_size // 2, cube_size // 2):
@@ -499,37 +1538,16 @@ def draw_scene():
     #             glBindVertexArray(0)
     #             glPopMatrix()
 
-    glPopMatrix()    
-
-def move_cubes(direction, default_move_speed):
-    # Choose a single cube to move based on direction
-    # For simplicity, let's always move the cube at the center
-    center_index = cube_size // 2
-    cube_to_move = cubes[center_index][center_index][center_index]
-
-    if direction == "LEFT":
-        cube_to_move.x -= default_move_speed
-    elif direction == "RIGHT":
-        cube_to_move.x += default_move_speed
-    elif direction == "UP":
-        cube_to_move.y += default_move_speed
-    elif direction == "DOWN":
-        cube_to_move.y -= default_move_speed
-
 # check if all cubes are destroyed
-def all_cubes_destroyed(cubes):
-    return all(cube.is_destroyed for row in cubes for layer in row for cube in layer)
+def all_cubes_destroyed(cube_field):
+    return cube_field.live_count == 0
 
 # # reset all cubes
-def reset_cubes(cubes):
-    for x_idx in range(-cube_size // 2, cube_size // 2):
-        for y_idx in range(-cube_size // 2, cube_size // 2):
-            for z_idx in range(-cube_size // 2, cube_size // 2):
-                cubes[x_idx][y_idx][z_idx] = Cube(x_idx + start_position[0],
-                                                  y_idx + start_position[1],
-                                                  z_idx + start_position[2])
-                cube = cubes[x_idx][y_idx][z_idx]
-                cube.reset_animation_state()
+def reset_cubes():
+    cube_field.reset()
+    debris.clear()
+    if body_mesh is not None:
+        body_mesh.rebuild()
 
 # def reset_cubes(cubes):
 #     # Logic to reset the cubes to their initial state
@@ -539,33 +1557,13 @@ def reset_cubes(cubes):
 #                 cubes[x][y][z] = Cube(x, y, z)  # Recreate the cube
 #                 cube.reset_animation_state()  # Reset animation state
 
-# flash the screen
-def flash_screen(duration=1000, steps=255):
+# Flash the screen white and back without blocking the game loop;
+# on_peak runs while the screen is fully white (see cube_common.ScreenTransition)
+def flash_screen(duration=1000, on_peak=None):
     # Duration of the flash in milliseconds
-    # Steps are how many levels of fading we have
-
-    # Fade to white
-    for i in range(steps):
-        alpha = i / steps
-        glClearColor(alpha, alpha, alpha, 1)
-        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-        pygame.display.flip()
-        pygame.time.wait(duration // (steps * 2))  # Wait proportionally to fade duration
-
-    # Hold the white screen
-    pygame.time.wait(duration // steps)  # Hold the white screen for a moment
-
-    # Fade back into the game
-    for i in range(steps, -1, -1):
-        alpha = i / steps
-        glClearColor(alpha, alpha, alpha, 1)
-        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-        draw_scene()  # Draw the game scene with the faded alpha overlay
-        pygame.display.flip()
-        pygame.time.wait(duration // (steps * 2))  # Wait proportionally to fade duration
-
-    # Reset clear color to game's background color
-    glClearColor(0, 0, 0, 1)  # Assuming black is the game's background color
+    screen_transition.start(duration / 1000.0, on_peak=on_peak)
+
+screen_transition = cube_common.ScreenTransition()
 
 # Additional global variables for effects
 screen_shake_duration = 0.5  # Duration of the shake in seconds
@@ -584,54 +1582,102 @@ def update_effects(delta_time):
         screen_shake_timer -= delta_time
     if flash_timer > 0:
         flash_timer -= delta_time
+    screen_transition.update(delta_time)
 
-def apply_screen_shake():
+# Random camera offset while the screen shakes (applied in draw_scene)
+def screen_shake_offset():
     if screen_shake_timer > 0:
         shake_intensity = 0.5  # Adjust as needed
         random_offset_x = random.uniform(-shake_intensity, shake_intensity)
         random_offset_y = random.uniform(-shake_intensity, shake_intensity)
-        glTranslatef(random_offset_x, random_offset_y, 0)
+        return random_offset_x, random_offset_y
+    return 0.0, 0.0
 
 def render_flash_effect():
     if flash_timer > 0:
-        # Enable blending for transparency
-        glEnable(GL_BLEND)
-        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
-
-        # Set orthographic projection to cover the whole screen
-        glMatrixMode(GL_PROJECTION)
-        glPushMatrix()
-        glLoadIdentity()
-        gluOrtho2D(-1, 1, -1, 1)
-
-        glMatrixMode(GL_MODELVIEW)
-        glPushMatrix()
-        glLoadIdentity()
-
-        # Set the color to red with the alpha based on flash_timer
-        glColor4f(1.0, 0.0, 0.0, min(flash_timer / flash_duration, 1.0))
-
-        # Draw a full-screen quad for the red flash effect
-        glBegin(GL_QUADS)
-        glVertex2f(-1, -1)
-        glVertex2f(1, -1)
-        glVertex2f(1, 1)
-        glVertex2f(-1, 1)
-        glEnd()
-
-        # Restore matrices and disable blending
-        glPopMatrix()
-        glMatrixMode(GL_PROJECTION)
-        glPopMatrix()
-        glMatrixMode(GL_MODELVIEW)
-        glDisable(GL_BLEND)
+        # Red full-screen flash, fading out with flash_timer
+        cube_common.draw_fullscreen_quad(1.0, 0.0, 0.0, min(flash_timer / flash_duration, 1.0))
+
+# Fixed-timestep scheduler on top of pygame.time.Clock: the simulation always
+# advances in steps of the same length, however long a rendered frame takes
+class GameClock:
+    def __init__(self, step=1.0 / 60.0, max_steps=5, max_fps=60):
+        self.clock = pygame.time.Clock()
+        self.step = step  # Simulation step length in seconds
+        self.max_steps = max_steps  # Most catch-up steps run in one frame
+        self.max_fps = max_fps  # Render frame rate cap (0 = uncapped)
+        self.accumulator = 0.0  # Real time not yet simulated
+        self.frame_time = 0.0  # Real time of the last frame
+        self.alpha = 0.0  # How far the render lies between the last two steps
+
+    # Wait for the next frame and return the real time since the last one
+    def tick(self):
+        self.frame_time = self.clock.tick(self.max_fps) / 1000.0
+        self.accumulator += self.frame_time
+        return self.frame_time
+
+    # Yield the step length once for every simulation step due this frame
+    def steps(self):
+        steps_taken = 0
+        while self.accumulator >= self.step:
+            if steps_taken == self.max_steps:
+                # Too far behind (e.g. after a stall): drop the backlog instead of spiralling
+                self.accumulator %= self.step
+                break
+            self.accumulator -= self.step
+            steps_taken += 1
+            yield self.step
+        self.alpha = self.accumulator / self.step
+
+# Simulation runs at 60 steps per second, rendering is capped at 60 FPS
+game_clock = GameClock(step=1.0 / 60.0, max_steps=5, max_fps=60)
+
+# Frame time statistics shown in the window title, to compare the render paths
+frame_stats_interval = 1.0  # Seconds between title updates
+frame_stats_frames = 0
+frame_stats_elapsed = 0.0
+
+def report_frame_time(frame_seconds):
+    global frame_stats_frames, frame_stats_elapsed
+    frame_stats_frames += 1
+    frame_stats_elapsed += frame_seconds
+    if frame_stats_elapsed >= frame_stats_interval:
+        render_path = "instanced" if use_instanced_rendering else "per-cube"
+        if use_instanced_rendering and use_face_culling:
+            render_path += f" + culled mesh ({body_mesh.face_count} faces)"
+        if world is not None:
+            render_path += f" + {len(world.resident)} level chunks"
+        if use_frustum_culling:
+            render_path += f" + frustum culling ({100.0 * frustum.take_stats()['total']:.0f}% culled)"
+        frame_ms = 1000.0 * frame_stats_elapsed / frame_stats_frames
+        pygame.display.set_caption(f"Cube Libre (demo, v.{version_number}) - {render_path}: {frame_ms:.2f} ms/frame")
+        frame_stats_frames = 0
+        frame_stats_elapsed = 0.0
 
 # Main game loop
 while True:
+    game_clock.tick()
+    frame_start = time.perf_counter()
+
     for event in pygame.event.get():
         if event.type == pygame.QUIT:
             pygame.quit()
             quit()
+        # Toggle between the instanced and the per-cube render path
+        if (event.type == pygame.KEYDOWN and event.key == pygame.K_i and instance_program is not None
+                and not use_core_profile):
+            use_instanced_rendering = not use_instanced_rendering
+            print(f"[INFO] Instanced rendering: {'on' if use_instanced_rendering else 'off'}")
+        # Toggle the face-culled mesh for the intact cubes
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_c and body_mesh is not None:
+            use_face_culling = not use_face_culling
+            print(f"[INFO] Hidden-face culling: {'on' if use_face_culling else 'off'}")
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_g:
+            cycle_gradient_palette()
+        # Toggle view-frustum culling
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_f:
+            use_frustum_culling = not use_frustum_culling
+            print(f"[INFO] Frustum culling: {'on' if use_frustum_culling else 'off'}")
 
     # Get the state of all keyboard keys
     keys = pygame.key.get_pressed()
@@ -642,106 +1688,87 @@ while True:
     # Check if CTRL is pressed
     ctrl_pressed = (keys[pygame.K_LCTRL] or keys[pygame.K_RCTRL])
 
-    # Now handle movements
+    # Now handle movements: collect one movement vector for the whole main cube
+    move_x, move_y, move_z = 0.0, 0.0, 0.0
+
     # Vertical movement (Y-axis)
     if keys[pygame.K_UP] or keys[pygame.K_w]:
-        for row in cubes:
-            for layer in row:
-                for cube in layer:
-                    cube.y += default_move_speed * shift_multiplier
+        move_y += default_move_speed
     if keys[pygame.K_DOWN] or keys[pygame.K_s]:
-        for row in cubes:
-            for layer in row:
-                for cube in layer:
-                    cube.y -= default_move_speed * shift_multiplier
+        move_y -= default_move_speed
 
     # Z-axis movement keys (Q/E) always move along Z-axis
     if keys[pygame.K_q]:
-        for row in cubes:
-            for layer in row:
-                for cube in layer:
-                    cube.z += z_default_move_speed * shift_multiplier
+        move_z += z_default_move_speed
     if keys[pygame.K_e]:
-        for row in cubes:
-            for layer in row:
-                for cube in layer:
-                    cube.z -= z_default_move_speed * shift_multiplier
+        move_z -= z_default_move_speed
 
     # If CTRL is pressed, A/D or LEFT/RIGHT move along Z-axis instead of X-axis
     if ctrl_pressed:
         # A/LEFT increase Z
         if keys[pygame.K_LEFT] or keys[pygame.K_a]:
-            for row in cubes:
-                for layer in row:
-                    for cube in layer:
-                        cube.z += z_default_move_speed * shift_multiplier
+            move_z += z_default_move_speed
         # D/RIGHT decrease Z
         if keys[pygame.K_RIGHT] or keys[pygame.K_d]:
-            for row in cubes:
-                for layer in row:
-                    for cube in layer:
-                        cube.z -= z_default_move_speed * shift_multiplier
+            move_z -= z_default_move_speed
     else:
         # Normal behavior (no CTRL): A/LEFT and D/RIGHT move along X-axis
         if keys[pygame.K_LEFT] or keys[pygame.K_a]:
-            for row in cubes:
-                for layer in row:
-                    for cube in layer:
-                        cube.x -= default_move_speed * shift_multiplier
+            move_x -= default_move_speed
         if keys[pygame.K_RIGHT] or keys[pygame.K_d]:
-            for row in cubes:
-                for layer in row:
-                    for cube in layer:
-                        cube.x += default_move_speed * shift_multiplier
+            move_x += default_move_speed
 
-    # Calculate delta time
-    delta_time = pygame.time.get_ticks() / 1000.0
+    # Run the simulation in fixed steps
+    for delta_time in game_clock.steps():
+        cube_field.save_state()
+        debris.save_state()
+        laser_field.save_state()
+        previous_angle_x, previous_angle_y, previous_angle_z = angle_x, angle_y, angle_z
 
-    # Update effects
-    update_effects(delta_time)
+        # Apply the movement once, by moving the body origin
+        if move_x or move_y or move_z:
+            cube_field.translate(*blocked_move(move_x * shift_multiplier, move_y * shift_multiplier,
+                                               move_z * shift_multiplier))
 
-    # Check for collisions and destroy one cube per layer
-    destruction_cooldown -= delta_time
-    if destruction_cooldown <= 0:
-        destroy_one_cube_per_layer()
-        destruction_cooldown = 1.0 / max_destruction_rate
+        # Update effects
+        update_effects(delta_time)
 
-    # Update cube positions and flash status
-    update_cubes(delta_time)
+        # Check for collisions and destroy one cube per layer
+        destruction_cooldown -= delta_time
+        if destruction_cooldown <= 0:
+            destroy_one_cube_per_layer()
+            destruction_cooldown = 1.0 / max_destruction_rate
 
-    # Check if all cubes are destroyed
-    if all_cubes_destroyed(cubes):
-        flash_screen()  # Flash the screen
-        reset_cubes(cubes)  # Reset the cubes to start over
-        continue  # Skip the rest of the loop to start with a fresh screen
+        # Sweep the lasers and destroy the cubes they touch
+        if laser_field.update(delta_time):
+            trigger_hit_effects()
 
-    # Clear the screen
-    glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        # Update cube positions and flash status
+        update_cubes(delta_time)
 
-    # Apply screen shake
-    glPushMatrix()  # Save the current state of transformations
-    if screen_shake_timer > 0:
-        apply_screen_shake()
+        # Update sway angles
+        angle_x += rotation_speed
+        angle_y += rotation_speed
+        angle_z += rotation_speed
 
-    draw_scene()
+    # Check if all cubes are destroyed
+    if all_cubes_destroyed(cube_field) and not screen_transition.active:
+        flash_screen(on_peak=reset_cubes)  # Flash the screen, reset the cubes behind it
 
-    glPushMatrix()        # Save the current transformation state
-    glLoadIdentity()      # Reset transformations
-    glTranslatef(*portal_position)
-    # draw_portal()
-    glPopMatrix()         # Restore the original transformation state
+    # Stream in the level chunks around the center of the body
+    if world is not None:
+        world.update((cube_field.origin + cube_field.grid_coords.mean(axis=0)) * step)
 
-    # Restore the original state after shake
-    glPopMatrix()
+    # Clear the screen
+    glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+
+    # Draw the scene, with screen shake
+    draw_scene(game_clock.alpha, screen_shake_offset())
 
     # Render the flash effect over the scene if needed
     if flash_timer > 0:
         render_flash_effect()
+    screen_transition.render()
 
-    # Update sway angles
-    angle_x += rotation_speed
-    angle_y += rotation_speed
-    angle_z += rotation_speed
-
-    pygame.display.flip()
-    pygame.time.wait(10)
+    cube_common.flip()
+    report_frame_time(time.perf_counter() - frame_start)
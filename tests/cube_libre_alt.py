@@ -7,6 +7,10 @@
 version_number = "0.12.6"
 
 import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import cube_common  # Must come before pygame / OpenGL (sets up --headless)
+
 import pygame
 
 from pygame.locals import DOUBLEBUF, OPENGL
@@ -66,7 +70,7 @@ pygame.display.gl_set_attribute(pygame.GL_CONTEXT_MINOR_VERSION, 3)
 pygame.display.gl_set_attribute(pygame.GL_CONTEXT_PROFILE_MASK, pygame.GL_CONTEXT_PROFILE_COMPATIBILITY)
 
 try:
-    pygame.display.set_mode(display, DOUBLEBUF | OPENGL)
+    cube_common.set_mode(display, DOUBLEBUF | OPENGL)
 except pygame.error as e:
     print(f"Pygame failed to set display mode with OpenGL: {e}")
     pygame.quit()
@@ -196,6 +200,7 @@ class Cube:
         self.x = x
         self.y = y
         self.z = z
+        self.initial_x, self.initial_y, self.initial_z = x, y, z
         self.color = self.random_color()
         self.is_destroyed = False
         self.flash_duration = 0.2  # Duration of flash effect in seconds
@@ -209,7 +214,10 @@ class Cube:
         return [random.uniform(0, 1) for _ in range(3)]
 
     def destroy(self):
-        print("Destroying cube")  # Debugging statement        
+        cube_common.log.count('cubes destroyed')
+        cube_common.log.debug("Destroying cube")
+        if not self.is_destroyed:
+            cube_counts.cube_destroyed()
         self.color = [0.8, 0.8, 0.8]  # Flash effect on destruction
         # Set original fly-off velocities
         self.velocity = [random.uniform(-1, 1), random.uniform(1, 2), random.uniform(-1, 1)]
@@ -231,6 +239,9 @@ cubes = [[[Cube(x, y, z) for z in range(-cube_size // 2, cube_size // 2)]
           for y in range(-cube_size // 2, cube_size // 2)] 
          for x in range(-cube_size // 2, cube_size // 2)]
 
+# Live / destroyed counts, kept up to date by Cube.destroy and reset_cubes
+cube_counts = cube_common.CubeCounts(cube_size ** 3)
+
 # Define the portal boundaries for collision detection
 portal_half_size = portal_size / 2
 portal_bounds = {
@@ -248,20 +259,15 @@ horizon_y = -5
 # Define the number of stars
 num_stars = 1000
 
-# Generate random positions for stars
-stars = [(random.uniform(-50, 50), random.uniform(-50, 50), random.uniform(-50, 50)) for _ in range(num_stars)]
-
-def draw_stars():
-    glPointSize(2)  # Adjust point size for visibility
-    glBegin(GL_POINTS)
-    for star in stars:
-        glVertex3fv(star)
-    glEnd()
+# Random star positions, uploaded once (scroll with starfield.scroll)
+starfield = cube_common.Starfield(num_stars, extent=50)
 
 # Horizon collision detection (based on Y-axis)
 def check_collision_with_horizon(cube):
     if cube.y <= horizon_y:
-        print(f"Collision detected with horizon for cube at ({cube.x:.2f}, {cube.y:.2f}, {cube.z:.2f})")
+        cube_common.log.count('horizon collisions')
+        if cube_common.log.debug_enabled:
+            cube_common.log.debug("Collision detected with horizon for cube at (%.2f, %.2f, %.2f)", cube.x, cube.y, cube.z)
         return True
     return False
 
@@ -278,10 +284,42 @@ def check_collision_with_portal(cube):
     reached_z = portal_bounds['z_min'] <= cube_pos[2] <= portal_bounds['z_max']
     
     if within_x and within_y and reached_z:
-        print(f"Collision detected with portal for cube at position ({cube.x:.2f}, {cube.y:.2f}, {cube.z:.2f})")
+        cube_common.log.count('portal collisions')
+        if cube_common.log.debug_enabled:
+            cube_common.log.debug("Collision detected with portal for cube at position (%.2f, %.2f, %.2f)", cube.x, cube.y, cube.z)
         return True
     return False
 
+# World obstacles for broadphase collision queries (see cube_common.SpatialHash)
+world_obstacles = cube_common.SpatialHash(cell_size=4.0)
+world_obstacles.insert('portal',
+                       (portal_bounds['x_min'], portal_bounds['y_min'], portal_bounds['z_min']),
+                       (portal_bounds['x_max'], portal_bounds['y_max'], portal_bounds['z_max']))
+
+# How far the body has moved from its rest layout (see body_bounds)
+body_offset = [0.0, 0.0, 0.0]
+
+# Move every cube of the body, destroyed or not, by the same amount
+def move_body(delta_x, delta_y, delta_z):
+    body_offset[0] += delta_x
+    body_offset[1] += delta_y
+    body_offset[2] += delta_z
+    for row in cubes:
+        for layer in row:
+            for cube in layer:
+                cube.x += delta_x
+                cube.y += delta_y
+                cube.z += delta_z
+
+# Bounding box of the cubes still attached to the body (None once all are destroyed):
+# intact cubes only move together, so it is the rest layout moved by body_offset
+rest_min, rest_max = -cube_size // 2, cube_size // 2 - 1
+
+def body_bounds():
+    if cube_counts.all_destroyed:
+        return None
+    return tuple(tuple((rest + offset) * step for offset in body_offset) for rest in (rest_min, rest_max))
+
 # Update cube positions based on velocity
 def update_cubes(delta_time):
     global screen_shake_timer, flash_timer
@@ -300,35 +338,11 @@ def update_cubes(delta_time):
                         cube.z += cube.velocity[2] * delta_time
                         cube.rotation += cube.angular_velocity * delta_time  # Update rotation
 
-# Draw the wireframe horizon
-def draw_wireframe_horizon():
-    glColor3f(1.0, 1.0, 1.0)  # White color
-    glLineWidth(1)  # Set line width
-    glBegin(GL_LINES)
-
-    # Horizontal lines
-    for z in range(-50, 51, 5):  # Adjust range and step for density
-        glVertex3f(-50, horizon_y, z)  # Adjust Y-coordinate for vertical position
-        glVertex3f(50, horizon_y, z)
+# The wireframe horizon, built once into a static VBO
+horizon_grid = cube_common.HorizonGrid(extent=50, step=5, y=horizon_y)
 
-    # Vertical lines
-    for x in range(-50, 51, 5):  # Adjust range and step for density
-        glVertex3f(x, horizon_y, -50)  # Starting from far distance
-        glVertex3f(x, horizon_y, 50)   # Up to close distance
-
-    glEnd()
-
-def gradient_color(y):
-    # Assuming the vertical range is from -cube_size/2 to cube_size/2
-    gradient_start = [1, 0, 0] # Red at the top
-    gradient_end = [0, 0, 1] # Blue at the bottom
-    factor = (y + cube_size/2) / cube_size # Normalize y to range [0, 1]
-    color = [
-        gradient_start[0] * (1 - factor) + gradient_end[0] * factor,
-        gradient_start[1] * (1 - factor) + gradient_end[1] * factor,
-        gradient_start[2] * (1 - factor) + gradient_end[2] * factor
-    ]
-    return color
+# Red-to-blue gradient over the height of the cube body, precomputed into a lookup table
+gradient_lut = cube_common.GradientLUT(cube_common.gradient_palettes['classic'], -cube_size / 2, cube_size / 2)
 
 def draw_scene(animation_scale=1.0):
     # Rendering
@@ -344,14 +358,15 @@ def draw_scene(animation_scale=1.0):
     glRotatef(angle_z, 0, 0, 1)
 
     # Draw wireframe horizon
-    draw_wireframe_horizon()
+    horizon_grid.draw()
 
     # Draw stars
     glColor3f(1, 1, 1)  # White stars
-    draw_stars()
+    starfield.draw()
 
     # *** Enable blending for transparency if any cubes are destroyed ***
-    if any(cube.is_destroyed for row in cubes for layer in row for cube in layer):
+    blending = cube_counts.destroyed > 0
+    if blending:
         glEnable(GL_BLEND)
         glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
 
@@ -366,15 +381,14 @@ def draw_scene(animation_scale=1.0):
                     # *** Preserve original color and apply transparency ***
                     glColor4f(*cube.color, 0.5)  # Original color with alpha
                 else:
-                    gradient_color_value = gradient_color(cube.y)
-                    glColor3fv(gradient_color_value)
+                    glColor3fv(gradient_lut.color(cube.y))
                 glBindVertexArray(vao)
                 glDrawArrays(GL_QUADS, 0, 24)
                 glBindVertexArray(0)
                 glPopMatrix()
 
     # *** Disable blending after drawing cubes ***
-    if any(cube.is_destroyed for row in cubes for layer in row for cube in layer):
+    if blending:
         glDisable(GL_BLEND)
 
     # *** Begin Portal Rendering ***
@@ -421,45 +435,29 @@ def draw_portal():
     glPopMatrix()
 
 def all_cubes_destroyed(cubes):
-    return all(cube.is_destroyed for row in cubes for layer in row for cube in layer)
+    return cube_counts.all_destroyed
 
 def reset_cubes(cubes):
     # Logic to reset the cubes to their initial state
-    print("Resetting all cubes to initial state.")
+    cube_common.log.info("Resetting all cubes to initial state.")
     for x in range(-cube_size // 2, cube_size // 2):
         for y in range(-cube_size // 2, cube_size // 2):
             for z in range(-cube_size // 2, cube_size // 2):
                 cubes[x][y][z].reset_animation_state()
-                print(f"Cube at ({cubes[x][y][z].x:.2f}, {cubes[x][y][z].y:.2f}, {cubes[x][y][z].z:.2f}) has been reset.")
-
-# Flash the screen
-def flash_screen(duration=1000, steps=255):
+                if cube_common.log.debug_enabled:
+                    cube = cubes[x][y][z]
+                    cube_common.log.debug("Cube at (%.2f, %.2f, %.2f) has been reset.", cube.x, cube.y, cube.z)
+    cube_counts.reset()
+    body_offset[:] = [0.0, 0.0, 0.0]
+    cube_common.log.count('cubes reset', cube_size ** 3)
+
+# Flash the screen white and back without blocking the game loop;
+# on_peak runs while the screen is fully white (see cube_common.ScreenTransition)
+def flash_screen(duration=1000, on_peak=None):
     # Duration of the flash in milliseconds
-    # Steps are how many levels of fading we have
-
-    # Fade to white
-    for i in range(steps):
-        alpha = i / steps
-        glClearColor(alpha, alpha, alpha, 1)
-        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-        draw_scene()
-        pygame.display.flip()
-        pygame.time.wait(duration // (steps * 2))  # Wait proportionally to fade duration
-
-    # Hold the white screen
-    pygame.time.wait(duration // steps)  # Hold the white screen for a moment
-
-    # Fade back into the game
-    for i in range(steps, -1, -1):
-        alpha = i / steps
-        glClearColor(alpha, alpha, alpha, 1)
-        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-        draw_scene()  # Draw the game scene with the faded alpha overlay
-        pygame.display.flip()
-        pygame.time.wait(duration // (steps * 2))  # Wait proportionally to fade duration
-
-    # Reset clear color to game's background color
-    glClearColor(0, 0, 0, 1)  # Assuming black is the game's background color
+    screen_transition.start(duration / 1000.0, on_peak=on_peak)
+
+screen_transition = cube_common.ScreenTransition()
 
 # Additional global variables for effects
 screen_shake_duration = 0.5  # Duration of the shake in seconds
@@ -478,6 +476,7 @@ def update_effects(delta_time):
         screen_shake_timer -= delta_time
     if flash_timer > 0:
         flash_timer -= delta_time
+    screen_transition.update(delta_time)
 
 def apply_screen_shake():
     if screen_shake_timer > 0:
@@ -488,37 +487,8 @@ def apply_screen_shake():
 
 def render_flash_effect():
     if flash_timer > 0:
-        # Enable blending for transparency
-        glEnable(GL_BLEND)
-        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
-
-        # Set orthographic projection to cover the whole screen
-        glMatrixMode(GL_PROJECTION)
-        glPushMatrix()
-        glLoadIdentity()
-        gluOrtho2D(-1, 1, -1, 1)
-
-        glMatrixMode(GL_MODELVIEW)
-        glPushMatrix()
-        glLoadIdentity()
-
-        # Set the color to red with the alpha based on flash_timer
-        glColor4f(1.0, 0.0, 0.0, min(flash_timer / flash_duration, 1.0))
-
-        # Draw a full-screen quad for the red flash effect
-        glBegin(GL_QUADS)
-        glVertex2f(-1, -1)
-        glVertex2f(1, -1)
-        glVertex2f(1, 1)
-        glVertex2f(-1, 1)
-        glEnd()
-
-        # Restore matrices and disable blending
-        glPopMatrix()
-        glMatrixMode(GL_PROJECTION)
-        glPopMatrix()
-        glMatrixMode(GL_MODELVIEW)
-        glDisable(GL_BLEND)
+        # Red full-screen flash, fading out with flash_timer
+        cube_common.draw_fullscreen_quad(1.0, 0.0, 0.0, min(flash_timer / flash_duration, 1.0))
 
 # Main game loop
 while True:
@@ -537,94 +507,71 @@ while True:
     if not (keys[pygame.K_LSHIFT] or keys[pygame.K_RSHIFT]):
         # X-Axis Movement
         if keys[pygame.K_LEFT] or keys[pygame.K_a]:
-            for row in cubes:
-                for layer in row:
-                    for cube in layer:
-                        cube.x -= move_speed * delta_time
+            move_body(-move_speed * delta_time, 0.0, 0.0)
         if keys[pygame.K_RIGHT] or keys[pygame.K_d]:
-            for row in cubes:
-                for layer in row:
-                    for cube in layer:
-                        cube.x += move_speed * delta_time
+            move_body(move_speed * delta_time, 0.0, 0.0)
 
         # Y-Axis Movement
         if keys[pygame.K_UP] or keys[pygame.K_w]:
-            for row in cubes:
-                for layer in row:
-                    for cube in layer:
-                        cube.y += move_speed * delta_time
+            move_body(0.0, move_speed * delta_time, 0.0)
         if keys[pygame.K_DOWN] or keys[pygame.K_s]:
-            for row in cubes:
-                for layer in row:
-                    for cube in layer:
-                        cube.y -= move_speed * delta_time
+            move_body(0.0, -move_speed * delta_time, 0.0)
 
     # *** Begin Z-Axis Movement ***
     # Handle Z-axis movement only when Shift is pressed
     if keys[pygame.K_LSHIFT] or keys[pygame.K_RSHIFT]:
         # Z-Axis Movement with W/S (Forward/Backward)
         if keys[pygame.K_w]:
-            for row in cubes:
-                for layer in row:
-                    for cube in layer:
-                        cube.z += z_move_speed * delta_time  # Move forward along Z-axis
-                        print(f"Shift + W: Moving cube to z={cube.z:.2f}")  # Debug statement
+            move_body(0.0, 0.0, z_move_speed * delta_time)  # Move forward along Z-axis
+            cube_common.log.debug("Shift + W: Moving cubes to z offset %.2f", body_offset[2])
         if keys[pygame.K_s]:
-            for row in cubes:
-                for layer in row:
-                    for cube in layer:
-                        cube.z -= z_move_speed * delta_time  # Move backward along Z-axis
-                        print(f"Shift + S: Moving cube to z={cube.z:.2f}")  # Debug statement
+            move_body(0.0, 0.0, -z_move_speed * delta_time)  # Move backward along Z-axis
+            cube_common.log.debug("Shift + S: Moving cubes to z offset %.2f", body_offset[2])
 
         # Z-Axis Movement with A/D (Left/Right)
         if keys[pygame.K_a]:
-            for row in cubes:
-                for layer in row:
-                    for cube in layer:
-                        cube.z -= z_move_speed * delta_time  # Move left along Z-axis
-                        print(f"Shift + A: Moving cube to z={cube.z:.2f}")  # Debug statement
+            move_body(0.0, 0.0, -z_move_speed * delta_time)  # Move left along Z-axis
+            cube_common.log.debug("Shift + A: Moving cubes to z offset %.2f", body_offset[2])
         if keys[pygame.K_d]:
-            for row in cubes:
-                for layer in row:
-                    for cube in layer:
-                        cube.z += z_move_speed * delta_time  # Move right along Z-axis
-                        print(f"Shift + D: Moving cube to z={cube.z:.2f}")  # Debug statement
+            move_body(0.0, 0.0, z_move_speed * delta_time)  # Move right along Z-axis
+            cube_common.log.debug("Shift + D: Moving cubes to z offset %.2f", body_offset[2])
 
         # Z-Axis Movement with Left/Right Arrow Keys
         if keys[pygame.K_LEFT]:
-            for row in cubes:
-                for layer in row:
-                    for cube in layer:
-                        cube.z += z_move_speed * delta_time  # Move forward along Z-axis
-                        print(f"Shift + Left Arrow: Moving cube to z={cube.z:.2f}")  # Debug statement
+            move_body(0.0, 0.0, z_move_speed * delta_time)  # Move forward along Z-axis
+            cube_common.log.debug("Shift + Left Arrow: Moving cubes to z offset %.2f", body_offset[2])
         if keys[pygame.K_RIGHT]:
-            for row in cubes:
-                for layer in row:
-                    for cube in layer:
-                        cube.z -= z_move_speed * delta_time  # Move backward along Z-axis
-                        print(f"Shift + Right Arrow: Moving cube to z={cube.z:.2f}")  # Debug statement
+            move_body(0.0, 0.0, -z_move_speed * delta_time)  # Move backward along Z-axis
+            cube_common.log.debug("Shift + Right Arrow: Moving cubes to z offset %.2f", body_offset[2])
     # *** End Z-Axis Movement ***
 
     # *** Begin Portal and Grid Collision Detection ***
     if not is_animating:
         collision_detected = False
-        for row in cubes:
-            for layer in row:
-                for cube in layer:
-                    if not cube.is_destroyed:
-                        if check_collision_with_horizon(cube) or check_collision_with_portal(cube):
-                            collision_detected = True
-                            break
+        # Broadphase: only test the cubes one by one when the body reaches the
+        # horizon or an obstacle the hash finds near it
+        bounds = body_bounds()
+        near_horizon = bounds is not None and bounds[0][1] <= horizon_y * step
+        near_portal = bounds is not None and 'portal' in world_obstacles.query(*bounds)
+        if near_horizon or near_portal:
+            for row in cubes:
+                for layer in row:
+                    for cube in layer:
+                        if not cube.is_destroyed:
+                            if ((near_horizon and check_collision_with_horizon(cube))
+                                    or (near_portal and check_collision_with_portal(cube))):
+                                collision_detected = True
+                                break
+                    if collision_detected:
+                        break
                 if collision_detected:
                     break
-            if collision_detected:
-                break
 
         if collision_detected:
             # Trigger collision response
             is_animating = True
             animation_timer = animation_duration
-            print("Collision detected! Triggering cube destruction and animation.")
+            cube_common.log.info("Collision detected! Triggering cube destruction and animation.")
 
             # Set velocities for all small cubes to fly away
             for row in cubes:
@@ -655,12 +602,12 @@ while True:
 
         # Draw the scene with the current scale
         draw_scene(animation_scale)
-        pygame.display.flip()
+        cube_common.flip()
 
         if animation_timer <= 0:
             is_animating = False
             animation_scale = 1.0
-            print("Animation completed. Returning to the field.")
+            cube_common.log.info("Animation completed. Returning to the field.")
             # Optionally, reset cubes or perform other actions here
             reset_cubes(cubes)
         
@@ -675,10 +622,8 @@ while True:
     update_cubes(delta_time)
 
     # Check if all cubes are destroyed
-    if all_cubes_destroyed(cubes):
-        flash_screen()  # Flash the screen
-        reset_cubes(cubes)  # Reset the cubes to start over
-        continue  # Skip the rest of the loop to start with a fresh screen
+    if all_cubes_destroyed(cubes) and not screen_transition.active:
+        flash_screen(on_peak=lambda: reset_cubes(cubes))  # Flash the screen, reset the cubes behind it
 
     # Clear the screen
     glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
@@ -696,11 +641,12 @@ while True:
     # Render the flash effect over the scene if needed
     if flash_timer > 0:
         render_flash_effect()
+    screen_transition.render()
 
     # Update sway angles
     angle_x += rotation_speed * delta_time
     angle_y += rotation_speed * delta_time
     angle_z += rotation_speed * delta_time
 
-    pygame.display.flip()
+    cube_common.flip()
     # *** End Normal Rendering ***
@@ -6,6 +6,11 @@
 # changelog:
 # v0.13 - Added portal functionality
 
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import cube_common  # Must come before pygame / OpenGL (sets up --headless)
+
 import pygame
 from pygame.locals import DOUBLEBUF, OPENGL
 from OpenGL.GL import *
@@ -23,7 +28,7 @@ step = cube_spacing
 # Initialize Pygame and create a window
 pygame.init()
 display = (800, 600)
-pygame.display.set_mode(display, DOUBLEBUF | OPENGL)
+cube_common.set_mode(display, DOUBLEBUF | OPENGL)
 clock = pygame.time.Clock()
 
 # Enable depth testing
@@ -103,6 +108,7 @@ class Cube:
         self.x = x
         self.y = y
         self.z = z
+        self.rest_position = (x, y, z)  # Where reset_position puts the cube back
         self.color = self.random_color()  # Assign a random color at creation
         self.is_destroyed = False
         self.flash_duration = 0.2  # Duration of flash effect in seconds
@@ -115,7 +121,11 @@ class Cube:
 
     # Upon destruction
     def destroy(self):
-        print(f"Destroying cube at ({self.x}, {self.y}, {self.z})")  # Debugging statement        
+        cube_common.log.count('cubes destroyed')
+        if cube_common.log.debug_enabled:
+            cube_common.log.debug("Destroying cube at (%.2f, %.2f, %.2f)", self.x, self.y, self.z)
+        if not self.is_destroyed:
+            cube_counts.cube_destroyed()
         # Change color to white/grey for the flash effect
         self.color = [0.8, 0.8, 0.8]
         # Set velocity for flying off
@@ -125,18 +135,27 @@ class Cube:
         self.is_destroyed = True
         self.time_since_destroyed = 0  # Reset timer on destruction        
 
+    # Move the cube back to its place in the intact body
+    def reset_position(self):
+        self.x, self.y, self.z = self.rest_position
+
     # Reset the cube's animation state
     def reset_animation_state(self):
         self.color = self.random_color()
         self.is_destroyed = False
         self.velocity = [0.0, 0.0, 0.0]
         self.angular_velocity = 0.0
+        self.time_since_destroyed = 0
+        self.rotation = 0.0
 
 # Initialize cubes
 cubes = [[[Cube(x, y, z) for z in range(-cube_size // 2, cube_size // 2)] 
           for y in range(-cube_size // 2, cube_size // 2)] 
          for x in range(-cube_size // 2, cube_size // 2)]
 
+# Live / destroyed counts, kept up to date by Cube.destroy and reset_cubes
+cube_counts = cube_common.CubeCounts(cube_size ** 3)
+
 # Movement speed
 move_speed = 0.1
 
@@ -150,22 +169,20 @@ max_destruction_rate = 0.5  # 1.0 = One cube per second
 # Define the number of stars
 num_stars = 1000
 
-# Generate random positions for stars
-stars = [(random.uniform(-50, 50), random.uniform(-50, 50), random.uniform(-50, 50)) for _ in range(num_stars)]
-
-def draw_stars():
-    glPointSize(2)  # Adjust point size for visibility
-    glBegin(GL_POINTS)
-    for star in stars:
-        glVertex3fv(star)
-    glEnd()
+# Random star positions, uploaded once (scroll with starfield.scroll)
+starfield = cube_common.Starfield(num_stars, extent=50)
 
 # Helper function to map logical coordinates to list indices
 def get_cube_indices(x, y, z):
     return x + cube_size // 2, y + cube_size // 2, z + cube_size // 2
 
+# How far the body has moved from its rest layout (see body_bounds)
+body_offset = [0.0, 0.0]
+
 # Movement function updated for x and y directions
 def move_cubes(delta_x, delta_y):
+    body_offset[0] += delta_x
+    body_offset[1] += delta_y
     for row in cubes:
         for layer in row:
             for cube in layer:
@@ -175,7 +192,9 @@ def move_cubes(delta_x, delta_y):
 # Horizon collision detection
 def check_collision_with_horizon(cube):
     if cube.y <= horizon_y:
-        print(f"Collision detected for cube at ({cube.x}, {cube.y}, {cube.z})")
+        cube_common.log.count('horizon collisions')
+        if cube_common.log.debug_enabled:
+            cube_common.log.debug("Collision detected for cube at (%.2f, %.2f, %.2f)", cube.x, cube.y, cube.z)
         return True
     return False
 
@@ -198,23 +217,8 @@ def update_cubes(delta_time):
                         cube.z += cube.velocity[2] * delta_time
                         cube.rotation += cube.angular_velocity * delta_time  # This line should now work
 
-# Draw the wireframe horizon
-def draw_wireframe_horizon():
-    glColor3f(1.0, 1.0, 1.0)  # White color
-    glLineWidth(1)  # Set line width
-    glBegin(GL_LINES)
-
-    # Horizontal lines
-    for z in range(-20, 21, 2):  # Adjust range and step for density
-        glVertex3f(-20, horizon_y, z)  # Adjust Y-coordinate for vertical position
-        glVertex3f(20, horizon_y, z)
-
-    # Vertical lines
-    for x in range(-20, 21, 2):  # Adjust range and step for density
-        glVertex3f(x, horizon_y, -20)  # Starting from far distance
-        glVertex3f(x, horizon_y, 20)   # Up to close distance
-
-    glEnd()
+# The wireframe horizon, built once into a static VBO
+horizon_grid = cube_common.HorizonGrid(extent=20, step=2, y=horizon_y)
 
 def destroy_one_cube_per_layer():
     global screen_shake_timer, flash_timer  # Ensure these globals are declared if needed
@@ -239,21 +243,9 @@ def destroy_one_cube_per_layer():
         if layer_affected:
             trigger_hit_effects()  # Trigger effects when a cube is destroyed
 
-def gradient_color(y):
-    # Assuming the vertical range is from -cube_size/2 to cube_size/2
-    gradient_start = [1, 0, 0] # Red at the top
-    gradient_end = [0, 0, 1] # Blue at the bottom
-    factor = (y + cube_size/2) / cube_size # Normalize y to range [0, 1]
-    color = [
-        gradient_start[0] * (1 - factor) + gradient_end[0] * factor,
-        gradient_start[1] * (1 - factor) + gradient_end[1] * factor,
-        gradient_start[2] * (1 - factor) + gradient_end[2] * factor
-    ]
-    return color
-
-def update_star_positions(offset_x, offset_y, offset_z):
-    global stars
-    stars = [(x + offset_x, y + offset_y, z + offset_z) for (x, y, z) in stars]
+# Red-to-blue gradient over the height of the cube body, precomputed into a lookup table
+gradient_lut = cube_common.GradientLUT(cube_common.gradient_palettes['classic'], -cube_size / 2, cube_size / 2)
+
 
 def draw_scene():
     # Rendering
@@ -265,11 +257,11 @@ def draw_scene():
     glRotatef(angle_z, 0, 0, 1)
 
     # Draw wireframe horizon
-    draw_wireframe_horizon()
+    horizon_grid.draw()
 
     # Draw stars
     glColor3f(1, 1, 1)  # White stars
-    draw_stars()
+    starfield.draw()
 
     # Draw portal
     portal.render()
@@ -286,8 +278,7 @@ def draw_scene():
                     # Render the cube with a different style if it's destroyed
                     glColor4f(1.0, 1.0, 1.0, 0.5)  # Example: white and semi-transparent
                 else:
-                    gradient_color_value = gradient_color(cube.y)
-                    glColor3fv(gradient_color_value)
+                    glColor3fv(gradient_lut.color(cube.y))
                 glBindVertexArray(vao)
                 glDrawArrays(GL_QUADS, 0, 24)
                 glBindVertexArray(0)
@@ -296,45 +287,26 @@ def draw_scene():
     glPopMatrix()
 
 def all_cubes_destroyed(cubes):
-    return all(cube.is_destroyed for row in cubes for layer in row for cube in layer)
+    return cube_counts.all_destroyed
 
 def reset_cubes(cubes):
-    # Logic to reset the cubes to their initial state
-    for x in range(-cube_size // 2, cube_size // 2):
-        for y in range(-cube_size // 2, cube_size // 2):
-            for z in range(-cube_size // 2, cube_size // 2):
-                ix, iy, iz = get_cube_indices(x, y, z)
-                cubes[ix][iy][iz] = Cube(x, y, z)  # Recreate the cube
-                cubes[ix][iy][iz].reset_animation_state()  # Reset animation state
-
-# Flash the screen
-def flash_screen(duration=1000, steps=255):
+    # Logic to reset the cubes to their initial state, reusing the existing
+    # Cube objects instead of allocating new ones
+    for row in cubes:
+        for layer in row:
+            for cube in layer:
+                cube.reset_position()
+                cube.reset_animation_state()
+    cube_counts.reset()
+    body_offset[:] = [0.0, 0.0]
+
+# Flash the screen white and back without blocking the game loop;
+# on_peak runs while the screen is fully white (see cube_common.ScreenTransition)
+def flash_screen(duration=1000, on_peak=None):
     # Duration of the flash in milliseconds
-    # Steps are how many levels of fading we have
-
-    # Fade to white
-    for i in range(steps):
-        alpha = i / steps
-        glClearColor(alpha, alpha, alpha, 1)
-        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-        draw_scene()
-        pygame.display.flip()
-        pygame.time.wait(duration // (steps * 2))  # Wait proportionally to fade duration
-
-    # Hold the white screen
-    pygame.time.wait(duration // steps)  # Hold the white screen for a moment
-
-    # Fade back into the game
-    for i in range(steps, -1, -1):
-        alpha = i / steps
-        glClearColor(alpha, alpha, alpha, 1)
-        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-        draw_scene()  # Draw the game scene with the faded alpha overlay
-        pygame.display.flip()
-        pygame.time.wait(duration // (steps * 2))  # Wait proportionally to fade duration
-
-    # Reset clear color to game's background color
-    glClearColor(0, 0, 0, 1)  # Assuming black is the game's background color
+    screen_transition.start(duration / 1000.0, on_peak=on_peak)
+
+screen_transition = cube_common.ScreenTransition()
 
 # Additional global variables for effects
 screen_shake_duration = 0.5  # Duration of the shake in seconds
@@ -353,6 +325,7 @@ def update_effects(delta_time):
         screen_shake_timer -= delta_time
     if flash_timer > 0:
         flash_timer -= delta_time
+    screen_transition.update(delta_time)
 
 def apply_screen_shake():
     if screen_shake_timer > 0:
@@ -363,37 +336,8 @@ def apply_screen_shake():
 
 def render_flash_effect():
     if flash_timer > 0:
-        # Enable blending for transparency
-        glEnable(GL_BLEND)
-        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
-
-        # Set orthographic projection to cover the whole screen
-        glMatrixMode(GL_PROJECTION)
-        glPushMatrix()
-        glLoadIdentity()
-        gluOrtho2D(-1, 1, -1, 1)
-
-        glMatrixMode(GL_MODELVIEW)
-        glPushMatrix()
-        glLoadIdentity()
-
-        # Set the color to red with the alpha based on flash_timer
-        glColor4f(1.0, 0.0, 0.0, min(flash_timer / flash_duration, 1.0))
-
-        # Draw a full-screen quad for the red flash effect
-        glBegin(GL_QUADS)
-        glVertex2f(-1, -1)
-        glVertex2f(1, -1)
-        glVertex2f(1, 1)
-        glVertex2f(-1, 1)
-        glEnd()
-
-        # Restore matrices and disable blending
-        glPopMatrix()
-        glMatrixMode(GL_PROJECTION)
-        glPopMatrix()
-        glMatrixMode(GL_MODELVIEW)
-        glDisable(GL_BLEND)
+        # Red full-screen flash, fading out with flash_timer
+        cube_common.draw_fullscreen_quad(1.0, 0.0, 0.0, min(flash_timer / flash_duration, 1.0))
 
 class Portal:
     def __init__(self, x, y, z, width=3.0, height=2.0, segments=32):
@@ -425,15 +369,40 @@ portal = Portal(x=0.0, y=horizon_y, z=0.0, width=2.0, height=1.0, segments=32)
 # Define a threshold distance for collision with the portal
 collision_threshold = 1.5  # Adjust as needed based on portal size
 
+# World obstacles for broadphase collision queries (see cube_common.SpatialHash)
+world_obstacles = cube_common.SpatialHash(cell_size=4.0)
+
+# Region in which a cube reaches the portal: within collision_threshold of it
+# on the ground plane, at or below the horizon
+def portal_bounds():
+    return ((portal.x - collision_threshold, -math.inf, portal.z - collision_threshold),
+            (portal.x + collision_threshold, horizon_y, portal.z + collision_threshold))
+
+world_obstacles.insert('portal', *portal_bounds())
+
+# Bounding box of the cubes still attached to the body (None once all are destroyed):
+# intact cubes only move together, so it is the rest layout moved by body_offset
+rest_min, rest_max = -cube_size // 2, cube_size // 2 - 1
+
+def body_bounds():
+    if cube_counts.all_destroyed:
+        return None
+    return ((rest_min + body_offset[0], rest_min + body_offset[1], rest_min),
+            (rest_max + body_offset[0], rest_max + body_offset[1], rest_max))
+
 # Function to check collision between any cube and the portal
 def check_collision_with_portal():
+    # Broadphase: only test the cubes one by one when the body is near the portal
+    bounds = body_bounds()
+    if bounds is None or 'portal' not in world_obstacles.query(*bounds):
+        return False
     for row in cubes:
         for layer in row:
             for cube in layer:
                 if not cube.is_destroyed:
                     distance = math.sqrt((cube.x - portal.x) ** 2 + (cube.z - portal.z) ** 2)
                     if distance <= collision_threshold and cube.y <= horizon_y:
-                        print("Portal reached! Ending game.")
+                        cube_common.log.info("Portal reached! Ending game.")
                         return True
     return False
 
@@ -447,7 +416,8 @@ def reset_scene(cubes):
     # Reset portal to a new random position on the horizon
     portal.x = random.uniform(-10.0, 10.0)
     portal.z = random.uniform(-10.0, 10.0)
-    print("Scene has been reset!")
+    world_obstacles.move('portal', *portal_bounds())
+    cube_common.log.info("Scene has been reset!")
 
 # Main game loop
 while True:
@@ -490,16 +460,12 @@ while True:
     update_cubes(delta_time)
 
     # Check if all cubes are destroyed
-    if all_cubes_destroyed(cubes):
-        flash_screen()  # Flash the screen
-        reset_cubes(cubes)  # Reset the cubes to start over
-        continue  # Skip the rest of the loop to start with a fresh screen
+    if all_cubes_destroyed(cubes) and not screen_transition.active:
+        flash_screen(on_peak=lambda: reset_cubes(cubes))  # Flash the screen, reset the cubes behind it
 
     # Check collision with the portal
-    if check_collision_with_portal():
-        flash_screen()  # Flash the screen
-        reset_scene(cubes)  # Reset the scene
-        continue  # Skip the rest of the loop to start with a fresh screen
+    if not screen_transition.active and check_collision_with_portal():
+        flash_screen(on_peak=lambda: reset_scene(cubes))  # Flash the screen, reset the scene behind it
 
     # Clear the screen
     glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
@@ -517,10 +483,11 @@ while True:
     # Render the flash effect over the scene if needed
     if flash_timer > 0:
         render_flash_effect()
+    screen_transition.render()
 
     # Update rotation angles based on rotation speed and delta_time
     angle_x += rotation_speed * delta_time
     angle_y += rotation_speed * delta_time
     angle_z += rotation_speed * delta_time
 
-    pygame.display.flip()
+    cube_common.flip()
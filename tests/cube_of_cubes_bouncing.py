@@ -1,7 +1,11 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import cube_common  # Must come before pygame / OpenGL (sets up --headless)
+
 import pygame
 from pygame.locals import DOUBLEBUF, OPENGL
 from OpenGL.GL import *
-from OpenGL.GLUT import *
 from OpenGL.GLU import *
 import random  # Import the random module
 
@@ -19,7 +23,7 @@ step = cube_spacing
 # Initialize Pygame and create a window
 pygame.init()
 display = (800, 600)
-pygame.display.set_mode(display, DOUBLEBUF | OPENGL)
+cube_common.set_mode(display, DOUBLEBUF | OPENGL)
 
 # Enable depth testing
 glEnable(GL_DEPTH_TEST)
@@ -87,7 +91,7 @@ while True:
     glPushMatrix()
     glTranslatef(main_cube_x, main_cube_y, main_cube_z)
     glColor3f(1.0, 1.0, 1.0)  # Set color to white
-    glutSolidCube(main_cube_size)
+    cube_common.draw_cube(main_cube_size)
     glPopMatrix()
 
     # Draw the Rubik's Cube by creating solid small cubes with random colors
@@ -150,5 +154,5 @@ while True:
     angle_y += rotation_speed
     angle_z += rotation_speed
 
-    pygame.display.flip()
+    cube_common.flip()
     pygame.time.wait(10)
\ No newline at end of file
@@ -1,3 +1,8 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import cube_common  # Must come before pygame / OpenGL (sets up --headless)
+
 import pygame
 from pygame.locals import DOUBLEBUF, OPENGL
 from OpenGL.GL import *
@@ -15,7 +20,7 @@ step = cube_spacing
 # Initialize Pygame and create a window
 pygame.init()
 display = (800, 600)
-pygame.display.set_mode(display, DOUBLEBUF | OPENGL)
+cube_common.set_mode(display, DOUBLEBUF | OPENGL)
 
 # Enable depth testing
 glEnable(GL_DEPTH_TEST)
@@ -128,5 +133,5 @@ while True:
     angle_y += rotation_speed
     angle_z += rotation_speed
 
-    pygame.display.flip()
+    cube_common.flip()
     pygame.time.wait(10)
\ No newline at end of file
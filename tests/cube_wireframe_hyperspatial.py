@@ -1,3 +1,8 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import cube_common  # Must come before pygame / OpenGL (sets up --headless)
+
 import random
 import pygame
 import time
@@ -22,7 +27,7 @@ vertices = [
 # Initialize Pygame and create a window
 pygame.init()
 display = (800, 600)
-pygame.display.set_mode(display, DOUBLEBUF | OPENGL)
+cube_common.set_mode(display, DOUBLEBUF | OPENGL)
 
 # Set perspective
 gluPerspective(45, (display[0] / display[1]), 0.1, 50.0)
@@ -95,5 +100,5 @@ while True:
             glVertex3fv(vertex)
     glEnd()
 
-    pygame.display.flip()
+    cube_common.flip()
     pygame.time.wait(10)
\ No newline at end of file
@@ -1,12 +1,16 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import cube_common  # Must come before pygame / OpenGL (sets up --headless)
+
 import pygame
 from OpenGL.GL import *
-from OpenGL.GLUT import *
 from OpenGL.GLU import *
 
 # Initialize Pygame and OpenGL
 pygame.init()
 display = (800, 600)
-pygame.display.set_mode(display, pygame.DOUBLEBUF | pygame.OPENGL)
+cube_common.set_mode(display, pygame.DOUBLEBUF | pygame.OPENGL)
 
 # Perspective settings
 gluPerspective(45, (display[0] / display[1]), 0.1, 50.0)
@@ -22,6 +26,6 @@ while True:
     # Render a simple 3D cube
     glRotatef(1, 3, 1, 1)
     glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-    glutWireCube(2)
-    pygame.display.flip()
+    cube_common.draw_cube(2, wireframe=True)
+    cube_common.flip()
     pygame.time.wait(10)
@@ -1,3 +1,8 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import cube_common  # Must come before pygame / OpenGL (sets up --headless)
+
 import pygame
 
 # Initialize Pygame
@@ -5,7 +10,7 @@ pygame.init()
 
 # Set up the display
 window_size = (800, 600)
-window = pygame.display.set_mode(window_size)
+window = cube_common.set_mode(window_size, 0)
 pygame.display.set_caption("Polygon Drawing")
 
 # Main loop
@@ -22,7 +27,7 @@ while running:
     pygame.draw.polygon(window, (255, 255, 255), [(100, 100), (200, 50), (300, 100), (250, 200)])
 
     # Update the display
-    pygame.display.flip()
+    cube_common.flip()
 
 # Clean up
 pygame.quit()
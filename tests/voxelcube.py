@@ -1,52 +1,130 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import cube_common  # Must come before pygame / OpenGL (sets up --headless)
+
+import ctypes
 import random
+import numpy as np
 import pygame
 from pygame.locals import DOUBLEBUF, OPENGL
 from OpenGL.GL import *
 from OpenGL.GLUT import *
 from OpenGL.GLU import *
 
-class Voxel:
-    def __init__(self, position, size=0.1):
-        self.position = position
-        self.size = size
-        self.active = True
-
-    def get_vertices(self):
-        x, y, z = self.position
-        s = self.size / 2
-        return [
-            (x - s, y - s, z - s),
-            (x + s, y - s, z - s),
-            (x + s, y + s, z - s),
-            (x - s, y + s, z - s),
-            (x - s, y - s, z + s),
-            (x + s, y - s, z + s),
-            (x + s, y + s, z + s),
-            (x - s, y + s, z + s)
-        ]
-
-def create_voxel_cube(cube_size, voxel_size):
-    voxels = []
-    offset = cube_size * voxel_size / 2
-    for x in range(cube_size):
-        for y in range(cube_size):
-            for z in range(cube_size):
-                voxel_position = (x * voxel_size - offset, y * voxel_size - offset, z * voxel_size - offset)
-                voxels.append(Voxel(voxel_position, voxel_size))
-    return voxels
+# Greedy mesh of the visible voxel faces, kept in a VBO
+#
+# Faces are meshed per slice (axis, direction, layer): a voxel face is visible
+# when its neighbour in that direction is empty, and the visible faces of a
+# slice are merged into as few rectangles as possible. Every slice's quads are
+# cached, so removing a voxel only re-meshes the few slices it touches.
+class VoxelMesh:
+    def __init__(self, cube_size, voxel_size, bottom_color, top_color):
+        self.cube_size = cube_size
+        self.voxel_size = voxel_size
+        self.offset = cube_size * voxel_size / 2
+        self.bottom_color = np.array(bottom_color, dtype=np.float32)
+        self.top_color = np.array(top_color, dtype=np.float32)
+        self.occupied = np.ones((cube_size, cube_size, cube_size), dtype=bool)
+        self.slices = {}  # (axis, direction, layer) -> vertex array (x, y, z, r, g, b)
+        self.vertex_count = 0
+        self.vbo = glGenBuffers(1)
+        for axis in range(3):
+            for direction in (-1, 1):
+                for layer in range(cube_size):
+                    self.mesh_slice(axis, direction, layer)
+        self.upload()
+
+    # Faces of one layer that look into an empty neighbour layer
+    def visible_faces(self, axis, direction, layer):
+        layers = np.moveaxis(self.occupied, axis, 0)
+        neighbor = layer + direction
+        if 0 <= neighbor < self.cube_size:
+            return layers[layer] & ~layers[neighbor]
+        return layers[layer].copy()
+
+    # Merge the visible faces of a slice into rectangles: runs along each row,
+    # extended over the following rows for as long as the same run repeats
+    def greedy_quads(self, mask):
+        quads = []
+        open_runs = {}  # (v0, v1) -> first row
+        padded = np.zeros(mask.shape[1] + 2, dtype=np.int8)
+        for u in range(mask.shape[0] + 1):
+            runs = set()
+            if u < mask.shape[0] and mask[u].any():
+                padded[1:-1] = mask[u]
+                edges = np.flatnonzero(np.diff(padded))
+                runs = set(zip(edges[0::2].tolist(), edges[1::2].tolist()))
+            for run in list(open_runs):
+                if run not in runs:
+                    quads.append((open_runs.pop(run), u, run[0], run[1]))
+            for run in runs:
+                open_runs.setdefault(run, u)
+        return quads
+
+    def mesh_slice(self, axis, direction, layer):
+        quads = self.greedy_quads(self.visible_faces(axis, direction, layer))
+        if not quads:
+            self.slices.pop((axis, direction, layer), None)
+            return
+        u0, u1, v0, v1 = np.array(quads, dtype=np.float32).T
+        # Corners in grid units; faces lie on voxel boundaries
+        corners = np.empty((len(quads), 4, 3), dtype=np.float32)
+        corners[:, :, axis] = layer + (1 if direction > 0 else 0)
+        u_axis, v_axis = [a for a in range(3) if a != axis]
+        corners[:, :, u_axis] = np.stack([u0, u1, u1, u0], axis=1)
+        corners[:, :, v_axis] = np.stack([v0, v0, v1, v1], axis=1)
+        positions = corners.reshape(-1, 3) * self.voxel_size - self.offset - self.voxel_size / 2
+
+        # The gradient is linear in y, so it stays exact across merged quads
+        t = ((positions[:, 1] + self.offset + self.voxel_size / 2) / (2 * self.offset))[:, None]
+        colors = self.bottom_color + (self.top_color - self.bottom_color) * t
+        self.slices[(axis, direction, layer)] = np.hstack([positions, colors]).astype(np.float32)
+
+    def upload(self):
+        if self.slices:
+            vertices = np.concatenate(list(self.slices.values()))
+        else:
+            vertices = np.zeros((0, 6), dtype=np.float32)
+        self.vertex_count = len(vertices)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL_STATIC_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    # Remove a voxel and re-mesh only the slices whose faces it changes
+    def remove(self, x, y, z):
+        if not self.occupied[x, y, z]:
+            return
+        self.occupied[x, y, z] = False
+        for axis, layer in enumerate((x, y, z)):
+            for direction in (-1, 1):
+                # The voxel's own layer, and the neighbour layer whose face now shows
+                self.mesh_slice(axis, direction, layer)
+                if 0 <= layer - direction < self.cube_size:
+                    self.mesh_slice(axis, direction, layer - direction)
+        self.upload()
+
+    def draw(self):
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+        glVertexPointer(3, GL_FLOAT, 24, ctypes.c_void_p(0))
+        glColorPointer(3, GL_FLOAT, 24, ctypes.c_void_p(12))
+        glDrawArrays(GL_QUADS, 0, self.vertex_count)
+        glDisableClientState(GL_COLOR_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
 
 def get_random_color():
     return (random.random(), random.random(), random.random())
 
-def interpolate_color(color1, color2, t):
-    return tuple(a + (b - a) * t for a, b in zip(color1, color2))
-
 # Initialize Pygame and OpenGL
 pygame.init()
 display = (800, 600)
-pygame.display.set_mode(display, DOUBLEBUF | OPENGL)
+cube_common.set_mode(display, DOUBLEBUF | OPENGL)
 gluPerspective(45, (display[0] / display[1]), 0.1, 50.0)
 glTranslatef(0.0, 0.0, -25)
+glEnable(GL_DEPTH_TEST)
 
 # Cube settings
 x_limit = 5
@@ -59,10 +137,10 @@ last_time = pygame.time.get_ticks()
 fade_duration = 1.0
 last_collision_time = 0
 
-# Create voxel cube
-voxel_cube = create_voxel_cube(10, 0.5)  # 10x10x10 cube of voxels
-original_colors = [get_random_color() for _ in voxel_cube]
-gradient_colors = list(original_colors)
+# Create voxel cube (VOXEL_CUBE_SIZE voxels per edge, the body stays 5 units wide)
+cube_size = int(os.environ.get('VOXEL_CUBE_SIZE', '64'))
+voxel_size = 5.0 / cube_size
+voxel_mesh = VoxelMesh(cube_size, voxel_size, get_random_color(), get_random_color())
 
 # Main loop
 clock = pygame.time.Clock()
@@ -83,26 +161,21 @@ while True:
         collision_occurred = True
         velocity[0] *= -1 if position[0] > x_limit or position[0] < -x_limit else 1
         velocity[1] *= -1 if position[1] > y_limit or position[1] < -y_limit else 1
-        # Remove a random voxel
-        random.choice(voxel_cube).active = False
+        # Remove a random voxel that is still there
+        remaining = np.argwhere(voxel_mesh.occupied)
+        if len(remaining):
+            voxel_mesh.remove(*remaining[random.randrange(len(remaining))].tolist())
 
     # Rotate the cube
     angle += rotation_speed * delta_time
     glLoadIdentity()
     gluPerspective(45, (display[0] / display[1]), 0.1, 50.0)
-    glTranslatef(*position)
+    glTranslatef(position[0], position[1], position[2] - 25)
     glRotatef(angle, 3, 1, 1)
     glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
 
     # Draw the cube
-    glBegin(GL_QUADS)
-    for voxel, color in zip(voxel_cube, gradient_colors):
-        if voxel.active:
-            vertices = voxel.get_vertices()
-            for vertex in vertices:
-                glColor3fv(color)
-                glVertex3fv(vertex)
-    glEnd()
-
-    pygame.display.flip()
+    voxel_mesh.draw()
+
+    cube_common.flip()
     pygame.time.wait(10)
\ No newline at end of file